@@ -2,7 +2,7 @@ import numpy as np
 
 
 def compute_cr_oap_at_round(mu, arm_played, round_t):
-    mu_star = np.max(mu)
+    mu_star = np.nanmax(mu)
 
     # cumulative regret
     regret_matrix = mu_star - mu[arm_played[:, :round_t]]
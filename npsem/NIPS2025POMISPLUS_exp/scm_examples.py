@@ -1,6 +1,7 @@
 from collections import defaultdict
 
-from npsem.model import CausalDiagram, StructuralCausalModel, default_P_U, CD
+from npsem.model import CD
+from npsem.scm_spec import load_scm, spec_of
 from npsem.utils import rand_bw, seeded
 from npsem.pomis_plus import POMISplusSEQ
 
@@ -64,27 +65,24 @@ def X0toY2(devised=True, seed=None):
                    'U_Z2': rand_bw(0.01, 0.99, precision=2),
                    }
 
-        domains = defaultdict(lambda: (0, 1))
-
         # SCM with parametrization
-        M = StructuralCausalModel(G,
-                                  F={
-                                      'X0': lambda v: v['U_X0'] ^ v['U_X0Y0'],
-                                      'Z0': lambda v: v['X0'] ^ v['U_Z0'],
-                                      'Y0': lambda v: v['Z0'] ^ v['U_Y0'] ^ v['U_X0Y0'],
-
-                                      'X1': lambda v: v['U_X1'] ^ v['U_X1Y1'] ^ v['X0'],
-                                      'Z1': lambda v: v['X1'] ^ v['U_Z1'],
-                                      'Y1': lambda v: v['Z1'] ^ v['U_Y1'] ^ v['U_X1Y1'],
-
-                                      'X2': lambda v: v['U_X2'] ^ v['U_X2Y2'] ^ v['X1'],
-                                      'Z2': lambda v: v['X2'] ^ v['U_Z2'],
-                                      'Y2': lambda v: v['Z2'] ^ v['U_Y2'] ^ v['U_X2Y2'],
-                                  },
-                                  P_U=default_P_U(mu1),
-                                  D=domains,
-                                  more_U={'U_X0', 'U_Y0', 'U_Z0', 'U_X1', 'U_Z1', 'U_Y1', 'U_Z2', 'U_X2', 'U_Y2'})
-        return M, mu1
+        spec = spec_of(G.V, G.edges, G.confounded_to_3tuples(),
+                       F={
+                           'X0': ('xor', 'U_X0', 'U_X0Y0'),
+                           'Z0': ('xor', 'X0', 'U_Z0'),
+                           'Y0': ('xor', 'Z0', 'U_Y0', 'U_X0Y0'),
+
+                           'X1': ('xor', 'U_X1', 'U_X1Y1', 'X0'),
+                           'Z1': ('xor', 'X1', 'U_Z1'),
+                           'Y1': ('xor', 'Z1', 'U_Y1', 'U_X1Y1'),
+
+                           'X2': ('xor', 'U_X2', 'U_X2Y2', 'X1'),
+                           'Z2': ('xor', 'X2', 'U_Z2'),
+                           'Y2': ('xor', 'Z2', 'U_Y2', 'U_X2Y2'),
+                       },
+                       P_U=mu1,
+                       more_U={'U_X0', 'U_Y0', 'U_Z0', 'U_X1', 'U_Z1', 'U_Y1', 'U_Z2', 'U_X2', 'U_Y2'})
+        return load_scm(spec, backend='numpy'), mu1
 
 
 # new graph for testing DUC based POMIS+
@@ -145,39 +143,36 @@ def W0toY2(devised=True, seed=None):
                    'U_Z2': rand_bw(0.01, 0.99, precision=2),
                    }
 
-        domains = defaultdict(lambda: (0, 1))
-
         # SCM with parametrization
-        M = StructuralCausalModel(G,
-                                  F={
-                                      'W0': lambda v: v['U_W0'],
-                                      'X0': lambda v: v['U_X0'] ^ v['W0']^ v['U_X0Y0'],
-                                      'Y0': lambda v: v['X0'] ^ v['U_Y0'] ^ v['U_X0Y0'],
+        spec = spec_of(G.V, G.edges, G.confounded_to_3tuples(),
+                       F={
+                           'W0': 'U_W0',
+                           'X0': ('xor', 'U_X0', 'W0', 'U_X0Y0'),
+                           'Y0': ('xor', 'X0', 'U_Y0', 'U_X0Y0'),
 
-                                      'W1': lambda v: v['U_W1'],
-                                      'X1': lambda v: v['U_X1'] ^ v['W1']^ v['U_X1X2']^ v['U_X1Y1'] ^ v['X0'],
-                                      'Y1': lambda v: v['X1'] ^ v['U_Y1'] ^ v['U_X1Y1'],
+                           'W1': 'U_W1',
+                           'X1': ('xor', 'U_X1', 'W1', 'U_X1X2', 'U_X1Y1', 'X0'),
+                           'Y1': ('xor', 'X1', 'U_Y1', 'U_X1Y1'),
 
-                                      'W2': lambda v: v['U_W2'],
-                                      'X2': lambda v: v['U_X2'] ^ v['W2'] ^ v['U_X1X2'] ^ v['U_X2Y2'] ^ v['X1'],
-                                      'Y2': lambda v: v['X2'] ^ v['U_Y2'] ^ v['U_X2Y2'],
-                                  },
-                                  P_U=default_P_U(mu1),
-                                  D=domains,
-                                  more_U={
-                                      'U_Y0',
-                                      'U_Y1',
-                                      'U_Y2',
+                           'W2': 'U_W2',
+                           'X2': ('xor', 'U_X2', 'W2', 'U_X1X2', 'U_X2Y2', 'X1'),
+                           'Y2': ('xor', 'X2', 'U_Y2', 'U_X2Y2'),
+                       },
+                       P_U=mu1,
+                       more_U={
+                           'U_Y0',
+                           'U_Y1',
+                           'U_Y2',
 
-                                      'U_X0', 'U_X1', 'U_X2',
+                           'U_X0', 'U_X1', 'U_X2',
 
-                                      'U_W0', 'U_W1', 'U_W2',
+                           'U_W0', 'U_W1', 'U_W2',
 
-                                      'U_X1X2',
+                           'U_X1X2',
 
-                                      'U_X0Y0', 'U_X1Y1', 'U_X2Y2'
-                                  })
-        return M, mu1
+                           'U_X0Y0', 'U_X1Y1', 'U_X2Y2'
+                       })
+        return load_scm(spec, backend='numpy'), mu1
 
 
 # fig 3
@@ -229,35 +224,32 @@ def WttoYtprime(devised=True, seed=None):
                    'U_Z2': rand_bw(0.01, 0.99, precision=2),
                    }
 
-        domains = defaultdict(lambda: (0, 1))
-
         # SCM with parametrization
-        M = StructuralCausalModel(G,
-                                  F={
-                                      'W0': lambda v: v['U_W0'],
-                                      'X0': lambda v: v['U_X0'] ^ v['W0']^ v['U_X0Y0'],
-                                      'Z0': lambda v: v['U_Z0'] ^ v['X0'],
-                                      'Y0': lambda v: v['Z0'] ^ v['U_Y0'] ^ v['U_X0Y0'],
-
-                                      'W1': lambda v: v['U_W1'],
-                                      'X1': lambda v: v['U_X1'] ^ v['W1']^ v['U_X1Y1'] ^ v['X0'],
-                                      'Z1': lambda v: v['U_Z1'] ^ v['X1'],
-                                      'Y1': lambda v: v['Z1'] ^ v['U_Y1'] ^ v['U_X1Y1']
-                                  },
-                                  P_U=default_P_U(mu1),
-                                  D=domains,
-                                  more_U={
-                                      'U_Y0', 'U_Y1',
-
-                                      'U_X0', 'U_X1',
-
-                                      'U_Z0', 'U_Z1',
-
-                                      'U_W0', 'U_W1',
-
-                                      'U_X0Y0', 'U_X1Y1'
-                                  })
-        return M, mu1
+        spec = spec_of(G.V, G.edges, G.confounded_to_3tuples(),
+                       F={
+                           'W0': 'U_W0',
+                           'X0': ('xor', 'U_X0', 'W0', 'U_X0Y0'),
+                           'Z0': ('xor', 'U_Z0', 'X0'),
+                           'Y0': ('xor', 'Z0', 'U_Y0', 'U_X0Y0'),
+
+                           'W1': 'U_W1',
+                           'X1': ('xor', 'U_X1', 'W1', 'U_X1Y1', 'X0'),
+                           'Z1': ('xor', 'U_Z1', 'X1'),
+                           'Y1': ('xor', 'Z1', 'U_Y1', 'U_X1Y1')
+                       },
+                       P_U=mu1,
+                       more_U={
+                           'U_Y0', 'U_Y1',
+
+                           'U_X0', 'U_X1',
+
+                           'U_Z0', 'U_Z1',
+
+                           'U_W0', 'U_W1',
+
+                           'U_X0Y0', 'U_X1Y1'
+                       })
+        return load_scm(spec, backend='numpy'), mu1
 
 
 if __name__ == '__main__':
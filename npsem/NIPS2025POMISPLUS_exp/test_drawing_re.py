@@ -69,7 +69,7 @@ def naked_MAB_optimal_probability_plot(axes: Axes, arm_freqs, cut_time, legend=F
 
 def data_prep(directory):
     _, mu, results = load_result(directory)
-    mu_star = np.max(mu)
+    mu_star = np.nanmax(mu)
 
     regret_results = dict()
     arm_optimality_results = dict()
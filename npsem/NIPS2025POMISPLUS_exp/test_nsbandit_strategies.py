@@ -4,30 +4,32 @@ import os
 from pathlib import Path
 
 from npsem.NIPS2025POMISPLUS_exp.scm_examples import X0toY2, WttoYtprime, W0toY2
-from npsem.bandits import play_bandits
+from npsem.bandits import play_bandits, seed_of
 from npsem.model import StructuralCausalModel
-from npsem.scm_bandits import SCM_to_bandit_machine, ns_arm_types, ns_arms_of
+from npsem.scm_bandits import bandit_artifacts, ns_arm_types
 from npsem.utils import subseq, mkdirs
 
 
-def main_experiment(M: StructuralCausalModel, Ys: set(), num_trial=200, horizon=10000, n_jobs=1):
+def main_experiment(M: StructuralCausalModel, Ys: set(), num_trial=200, horizon=10000, n_jobs=1, cache_dir=None, algorithms=('TS', 'UCB'), seed=0):
     results = dict()
 
-    # mu: expected rewards of all arms
+    # mu: expected rewards of all arms, nan except the arms selected by the strategies and the optimal arm (for regret)
     # arm_setting: combinations of realizations for each intervention set (e.g., {'0': {}, '1':{'S' : 0, 'T' :1},...})
-    mu, arm_setting = SCM_to_bandit_machine(M, Ys=Ys)
+    # arms_of: selected arm index from each strategy (POMIS/POMIS+) in the arm_setting (e.g., 11, 12, 13, 14, 27...)
+    # all of which are reloaded from cache_dir if computed for the same model and Ys before
+    mu, arm_setting, arms_of = bandit_artifacts(M, Ys, ns_arm_types(), cache_dir)
 
     for arm_strategy in ns_arm_types():
-
-        # selected arm index from the strategy (POMIS/POMIS+) in the arm_setting (e.g., 11, 12, 13, 14, 27...)
-        arm_selected = ns_arms_of(arm_strategy, arm_setting, M.G, Ys)
+        arm_selected = arms_of[arm_strategy]
 
         # mapping function (e.g., arm_corrector(1) => arm_setting[X] = 12)
         arm_corrector = np.vectorize(lambda x: arm_selected[x])
 
-        for bandit_algo in ['TS', 'UCB']:
+        for bandit_algo in algorithms:  # names in npsem.bandits.POLICIES
             # subseq(mu, arm_selected) : extract the expected reward corresponding to the arm_selected from the mu
-            arm_played, rewards = play_bandits(horizon, subseq(mu, arm_selected), bandit_algo, num_trial, n_jobs)
+            # trials are seeded per (strategy, algorithm, trial), independent of the order and scheduling of the runs
+            arm_played, rewards = play_bandits(horizon, subseq(mu, arm_selected), bandit_algo, num_trial, n_jobs,
+                                               seed=seed_of(seed, arm_strategy, bandit_algo))
             results[(arm_strategy, bandit_algo)] = arm_corrector(arm_played), rewards
 
     return results, mu
@@ -42,20 +44,20 @@ def compute_arm_frequencies(arm_played, num_arms, horizon=None):
     return counts
 
 def compute_optimality(arm_played, mu):
-    mu_star = np.max(mu)
+    mu_star = np.nanmax(mu)
     return np.vectorize(lambda x: int(mu[x] == mu_star))(arm_played)
 
 def compute_cumulative_regret(arm_played: np.ndarray, mu: np.ndarray) -> np.ndarray:
-    mu_star = np.max(mu)
+    mu_star = np.nanmax(mu)
     regret_matrix = mu_star - mu[arm_played]  # (num_trials, horizon)
     cumulative_regret = np.cumsum(regret_matrix, axis=1)
     return cumulative_regret
 
-def load_result(directory):
+def load_result(directory, algorithms=('TS', 'UCB')):
     results = dict()
     print(directory)
     for arm_strategy in ns_arm_types():
-        for bandit_algo in ['TS', 'UCB']:
+        for bandit_algo in algorithms:  # names in npsem.bandits.POLICIES
             loaded = np.load(directory + f'/{arm_strategy}---{bandit_algo}.npz', allow_pickle=True)
             arms = loaded['a']
             rewards = loaded['b']
@@ -105,7 +107,8 @@ def main():
         print("BASE_DIR:", BASE_DIR)
         print("directory:", directory)
 
-        results, mu = main_experiment(model, Ys, num_simulation_repeats, horizon, n_jobs=multiprocessing.cpu_count())
+        results, mu = main_experiment(model, Ys, num_simulation_repeats, horizon, n_jobs=multiprocessing.cpu_count(),
+                                      cache_dir=str(BASE_DIR / 'bandit_results/cache'))
         save_result(directory, p_u, mu, results)
         finished(directory, flag=True)
 
@@ -1,11 +1,196 @@
+import abc
+import hashlib
+import heapq
+import math
+import os
+import tempfile
+from collections import deque
+
 import numpy as np
-from joblib import Parallel, delayed
-from numpy.random.mtrand import beta
-from scipy.optimize import brenth
+from joblib import Parallel, delayed, effective_n_jobs
 from typing import Tuple
 from tqdm import tqdm
 
-from npsem.utils import seeded, rand_argmax, with_default
+from npsem.utils import mkdirs, with_default
+
+
+def seed_of(seed, *names) -> np.random.SeedSequence:
+    """ SeedSequence under seed (entropy or a SeedSequence) for names, e.g., of a strategy and an algorithm """
+    seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    keys = tuple(int(hashlib.sha256(name.encode()).hexdigest()[:8], 16) for name in names)
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + keys, pool_size=seed.pool_size)
+
+
+def trial_seeds(seed, repeat: int):
+    """ SeedSequences of repeat trials under seed, as seed.spawn(repeat) gives without changing seed """
+    seed = seed_of(seed)
+    return [np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + (trial,), pool_size=seed.pool_size)
+            for trial in range(repeat)]
+
+
+def trial_streams(seed) -> Tuple[np.random.Generator, ...]:
+    """
+    Generators of a trial from its seed (e.g., of trial_seeds) for the uniforms of rewards, one-off decisions (e.g., the
+    first arms of kl-UCB), uniforms for tie-breaking and random arms, and normals and uniforms for gamma variates.
+    They are independent of each other and of other trials, so that a trial plays the same sequentially, batched with
+    other trials, or in threads, and blocks of variates drawn from them do not depend on their sizes.
+    """
+    return tuple(np.random.default_rng(stream_seed) for stream_seed in trial_seeds(seed, 5))
+
+
+# variates per stream pregenerated at once for all trials of a simulation, bounding memory regardless of the horizon
+BLOCK_SIZE = 2 ** 16
+# trials played at once by a task of play_bandits at most by default, where a batch shares the work of a round
+BATCH_SIZE = 64
+
+
+class VariateBlocks:
+    """
+    Variates of each trial drawn by draw(rngs[b], n) in blocks of size per trial and taken in order, where a trial that
+    runs out keeps its remaining variates and draws the rest of its block. The variates of a trial are thus its stream
+    regardless of size and of the other trials, while memory is size per trial (or the largest take, if larger).
+    """
+
+    def __init__(self, rngs, draw, size: int):
+        self.rngs, self.draw = list(rngs), draw
+        self.buffer = np.array([draw(rng, size) for rng in self.rngs]).reshape(len(self.rngs), size)
+        self.cursor = np.zeros((len(self.rngs),), dtype=int)
+        self.rows = np.arange(len(self.rngs))
+
+    def _refill(self, b: int, count: int):
+        size = self.buffer.shape[1]
+        if count > size:  # widen the blocks of all trials with their following variates
+            self.buffer = np.hstack([self.buffer, np.array([self.draw(rng, count - size) for rng in self.rngs])])
+            size = count
+        rest = size - self.cursor[b]
+        self.buffer[b, :rest] = self.buffer[b, self.cursor[b]:]
+        self.buffer[b, rest:] = self.draw(self.rngs[b], size - rest)
+        self.cursor[b] = 0
+
+    def take_one(self) -> np.ndarray:
+        """ the next variate of each trial """
+        if len(self.rows) == 1:
+            return np.array([self.next()])
+        if np.any(self.cursor >= self.buffer.shape[1]):
+            for b in np.flatnonzero(self.cursor >= self.buffer.shape[1]).tolist():
+                self._refill(b, 1)
+        values = self.buffer[self.rows, self.cursor]
+        self.cursor += 1
+        return values
+
+    def next(self, b: int = 0) -> float:
+        """ the next variate of the b-th trial """
+        if self.cursor[b] >= self.buffer.shape[1]:
+            self._refill(b, 1)
+        value = self.buffer[b, self.cursor[b]]
+        self.cursor[b] += 1
+        return value.item()
+
+    def take(self, counts: np.ndarray) -> np.ndarray:
+        """ the next counts[b] variates of each trial b, concatenated in the order of trials """
+        if len(self.rows) == 1:
+            count = int(counts[0])
+            if self.cursor[0] + count > self.buffer.shape[1]:
+                self._refill(0, count)
+            start = self.cursor[0]
+            self.cursor[0] += count
+            return self.buffer[0, start:start + count]
+        over = self.cursor + counts > self.buffer.shape[1]
+        if over.any():
+            for b in np.flatnonzero(over).tolist():
+                self._refill(b, int(counts[b]))
+        if counts.max() <= 1:  # e.g., one variate of some trials
+            rows = np.flatnonzero(counts)
+            values = self.buffer[rows, self.cursor[rows]]
+            self.cursor[rows] += 1
+            return values
+        if np.all(counts == counts[0]):  # e.g., one variate per arm of each trial
+            cols = self.cursor[:, None] + np.arange(counts[0])
+            self.cursor += counts
+            return self.buffer[self.rows[:, None], cols].reshape(-1)
+        rows = np.repeat(self.rows, counts)
+        cols = self.cursor[rows] + np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        self.cursor += counts
+        return self.buffer[rows, cols]
+
+
+def _uniforms(rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.random(n)
+
+
+def _normals(rng: np.random.Generator, n: int) -> np.ndarray:
+    return rng.standard_normal(n)
+
+
+def _standard_gamma(shape: np.ndarray, normals: VariateBlocks, uniforms: VariateBlocks, out: np.ndarray):
+    """
+    Gamma(shape) variates of (trials x M) shapes (>= 1) into out, a C-contiguous array, by Marsaglia and Tsang (2000),
+    taking a normal and a uniform from the blocks of the trial for each entry of its row in order at once, and then the
+    next ones for each rejected entry (a few percent) in order until accepted, which is done for the first rejected entries
+    of all trials at once while many are left.
+    """
+    B, M = shape.shape
+    flat = out.reshape(-1)
+    d = shape.reshape(-1) - 1 / 3
+    c = 1 / np.sqrt(9 * d)
+    counts = np.full((B,), M)
+    x, u = normals.take(counts), uniforms.take(counts)
+    v = 1 + c * x
+    v = v * v * v
+    # log(1 - u) for u in [0, 1) is finite, and v <= 0 is rejected whatever log(v) is clipped to
+    rejected = (v <= 0) | (np.log1p(-u) >= 0.5 * x * x + d - d * v + d * np.log(np.maximum(v, 1e-300)))
+    np.multiply(d, v, out=flat)
+    pending = np.flatnonzero(rejected)
+    while len(pending) > 8:
+        # the first rejected entry of each trial draws next
+        entries = pending[np.r_[True, np.diff(pending // M) > 0]]
+        counts = np.zeros((B,), dtype=int)
+        counts[entries // M] = 1
+        x, u = normals.take(counts), uniforms.take(counts)
+        v = 1 + c[entries] * x
+        v = v * v * v
+        d_ = d[entries]
+        accepted = (v > 0) & (np.log1p(-u) < 0.5 * x * x + d_ - d_ * v + d_ * np.log(np.maximum(v, 1e-300)))
+        flat[entries[accepted]] = d_[accepted] * v[accepted]
+        rejected[entries[accepted]] = False
+        pending = np.flatnonzero(rejected)
+    for i in pending.tolist():
+        b, d_i, c_i = i // M, d[i].item(), c[i].item()
+        while True:
+            x_i, u_i = normals.next(b), uniforms.next(b)
+            v_i = (1 + c_i * x_i) ** 3
+            if v_i > 0 and math.log1p(-u_i) < 0.5 * x_i * x_i + d_i - d_i * v_i + d_i * math.log(v_i):
+                flat[i] = d_i * v_i
+                break
+
+
+def _rand_argmax(xs: np.ndarray, rand, ties: np.ndarray) -> int:
+    """ argmax of xs picking among ties by a uniform from rand(), with ties a boolean buffer like xs """
+    i = int(xs.argmax())
+    n_ties = np.count_nonzero(np.equal(xs, xs[i], out=ties))
+    if n_ties > 1:
+        i = int(np.flatnonzero(ties)[int(rand() * n_ties)])
+    return i
+
+
+def _rand_argmax_rows(xs: np.ndarray, noise: VariateBlocks, ties: np.ndarray, trials=None) -> np.ndarray:
+    """
+    _rand_argmax of each row of xs, the trials[b]-th trial (b by default) taking a uniform from noise if tied,
+    with ties a boolean buffer like a row for a trial played alone
+    """
+    if len(xs) == 1 and len(noise.rows) == 1:  # a trial played alone
+        return np.array([_rand_argmax(xs[0], noise.next, ties)])
+    arms = xs.argmax(axis=1)
+    ties = xs == xs[np.arange(len(xs)), arms][:, None]
+    n_ties = np.count_nonzero(ties, axis=1)
+    tied = np.flatnonzero(n_ties > 1)
+    if len(tied):
+        counts = np.zeros((len(noise.rows),), dtype=int)
+        counts[tied if trials is None else trials[tied]] = 1
+        for b, u in zip(tied.tolist(), noise.take(counts).tolist()):
+            arms[b] = np.flatnonzero(ties[b])[int(u * n_ties[b])]
+    return arms
+
 
 def KL(mu_x, mu_star, epsilon=1e-12):
     """ Kullback-Leibler Divergence with two parameters from two Bernoulli distributions """
@@ -24,49 +209,220 @@ def KL(mu_x, mu_star, epsilon=1e-12):
     return mu_x * np.log((mu_x + epsilon) / (mu_star + epsilon)) + (1 - mu_x) * np.log((1 - mu_x + epsilon) / (1 - mu_star + epsilon))
 
 
-def sup_KL(mu_ref, divergence, lower=None):
-    """ Find largest mu that satisfies KL(mu_ref, mu) <= divergence """
-    if divergence <= 0:
-        return mu_ref
-    if KL(mu_ref, 1.0) <= divergence:
+PAIRWISE_SUP_KL = 24  # sup_KL of up to this many pairs, one at a time (the same values), is faster than at once
+
+
+def sup_KL(mu_ref, divergence, epsilon=1e-12, xtol=2e-12, maxiter=100):
+    """
+    Find largest mu that satisfies KL(mu_ref, mu) <= divergence, elementwise for arrays (e.g., of all arms) at once.
+    Safeguarded Newton steps on z = log(1 - mu), where KL grows linearly as mu approaches 1, within a bracket from a lower
+    bound of the root (Pinsker's inequality, or KL >= -H(mu_ref) - (1 - mu_ref) log(1 - mu)) to mu_ref, until mu moves
+    less than xtol (as brenth).
+    """
+    if np.ndim(mu_ref) == 0 and np.ndim(divergence) == 0:
+        return _sup_KL_scalar(float(mu_ref), float(divergence), epsilon, xtol, maxiter)
+    p, d = (np.array(x, dtype=float) for x in np.broadcast_arrays(mu_ref, divergence))
+    if p.size <= PAIRWISE_SUP_KL:
+        pairs = zip(p.ravel().tolist(), d.ravel().tolist())
+        return np.array([_sup_KL_scalar(p_i, d_i, epsilon, xtol, maxiter) for p_i, d_i in pairs]).reshape(p.shape)
+    result = np.where(d <= 0, p, 1.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        at_one = p * np.log((p + epsilon) / (1 + epsilon)) + (1 - p) * np.log((1 - p + epsilon) / epsilon)
+        active = (d > 0) & (p < 1) & (at_one > d)  # otherwise, mu_ref for no divergence or 1 as KL(mu_ref, 1) <= divergence
+        p, d = p[active], d[active]
+        # fewer temporaries than masking, for the many calls on a few entries
+        p_log_p = p * np.log(p)
+        np.copyto(p_log_p, 0.0, where=p == 0)
+        entropy = -p_log_p - (1 - p) * np.log(1 - p)
+        lower = np.maximum(np.log1p(-np.minimum(p + np.sqrt(d / 2), 1)), np.maximum(-(d + entropy) / (1 - p), -700.0))
+        upper = np.log1p(-p)
+        z, converged = lower.copy(), np.zeros(len(p), dtype=bool)
+        q, p_eps, q_eps, e = 1 - p, p + epsilon, 1 - p + epsilon, np.exp(lower)
+        for _ in range(maxiter):
+            e_left, e_eps = 1 - e + epsilon, e + epsilon
+            g = p * np.log(p_eps / e_left) + q * np.log(q_eps / e_eps) - d
+            dg = p * e / e_left - q * e / e_eps
+            above = g > 0
+            np.copyto(lower, z, where=above)
+            np.copyto(upper, z, where=~above)
+            z_new = z - g / dg
+            np.copyto(z_new, (lower + upper) / 2, where=~((lower <= z_new) & (z_new <= upper)))
+            np.copyto(z_new, z, where=converged)
+            e_new = np.exp(z_new)
+            converged |= np.abs(e_new - e) < xtol
+            z, e = z_new, e_new
+            if converged.all():
+                break
+    result[active] = -np.expm1(z)
+    return result
+
+
+def _sup_KL_scalar(p: float, d: float, epsilon, xtol, maxiter) -> float:
+    """
+    sup_KL for a single pair with the same steps in plain floats, avoiding the overhead of small arrays. Logarithms and
+    exponentials are numpy's, which give the same values for floats as for arrays (unlike math's), hence the same results.
+    """
+    log, log1p, exp = np.log, np.log1p, np.exp
+    if d <= 0:
+        return p
+    q = 1 - p
+    if not (p < 1 and p * float(log((p + epsilon) / (1 + epsilon))) + q * float(log((q + epsilon) / epsilon)) > d):
         return 1.0
-    return brenth(lambda x: KL(mu_ref, x) - divergence, with_default(lower, mu_ref), 1)
-
-
-class U_keeper:
-    """  Keep look-ahead U values to save unnecessary computation (more effective if there is a large number of arms) """
-
-    def __init__(self, K_: int, T: int):
-        self.K_ = K_
-        self.T = T
-        self.lookahead_U = None
-        self.lookahead_t = None
-        self.step_sizes = None
-
-    def update_U(self, t, f, mu_hat, N, U, arm_x):
-        init_step_size = self.K_ * 2
-        T = self.T
-        K_ = self.K_
-        if t <= 5 * K_:
-            fval = f(t)
-            for i in range(K_):
-                U[i] = sup_KL(mu_hat[i], fval / N[i])
-            if t == 5 * K_:
-                ahead_t = min(t + init_step_size, T)
-                ft2 = f(ahead_t)
-                self.lookahead_U = np.array([sup_KL(mu_hat[i], ft2 / N[i]) for i in range(K_)])
-                self.lookahead_t = np.ones((len(mu_hat),)) * ahead_t
+    entropy = -(p * float(log(p)) if p > 0 else 0.0) - q * float(log(q))
+    pinsker = p + math.sqrt(d / 2)
+    lower = max(float(log1p(-pinsker)) if pinsker < 1 else -math.inf, max(-(d + entropy) / q, -700.0))
+    upper = float(log1p(-p))
+    z, e = lower, float(exp(lower))
+    p_eps, q_eps = p + epsilon, q + epsilon
+    for _ in range(maxiter):
+        e_left, e_eps = 1 - e + epsilon, e + epsilon
+        g = p * float(log(p_eps / e_left)) + q * float(log(q_eps / e_eps)) - d
+        dg = p * e / e_left - q * e / e_eps
+        if g > 0:
+            lower = z
         else:
-            fval = f(t)
-            threshold = U[arm_x] = sup_KL(mu_hat[arm_x], fval / N[arm_x])
-
-            for arm in np.where(self.lookahead_U >= threshold)[0]:
-                if arm != arm_x:
-                    U[arm] = sup_KL(mu_hat[arm], fval / N[arm])
-
-            for arm in set(np.where(self.lookahead_t == t)[0]) | {arm_x}:
-                self.lookahead_t[arm] = ahead_t = t + init_step_size
-                self.lookahead_U[arm] = sup_KL(mu_hat[arm], f(ahead_t) / N[arm])
+            upper = z
+        z_new = z - g / dg if dg else math.nan
+        if not lower <= z_new <= upper:
+            z_new = (lower + upper) / 2
+        e_new = float(exp(z_new))
+        converged = abs(e_new - e) < xtol
+        z, e = z_new, e_new
+        if converged:
+            break
+    return -float(np.expm1(z))
+
+
+class SupKLTable:
+    """
+    sup_KL tabulated on a grid of mu_ref (n_mu equal steps over [0, 1]) and divergence (n_divergence geometric steps over
+    [min_divergence, max_divergence]), looked up in the row of the grid point just above mu_ref, where sup_KL increases in
+    mu_ref, and interpolated in divergence within the cell, where sup_KL increases and is concave (the inverse of a convex
+    increasing KL), by the tangent at the lower divergence capped by the value at the upper one. A Newton step on KL from
+    this upper bound then tightens it, staying above the root, so that a looked-up value never under-estimates sup_KL.
+    Divergences outside the grid are computed by sup_KL.
+    The grid is saved to and loaded from directory if given, so that it is computed once across runs.
+    """
+
+    def __init__(self, n_mu=1024, n_divergence=2048, min_divergence=1e-7, max_divergence=100.0, directory=None):
+        self.n_mu = n_mu
+        self.divergences = np.geomspace(min_divergence, max_divergence, n_divergence)
+        path = None
+        if directory is not None:
+            path = os.path.join(directory, f'sup_kl_{n_mu}_{n_divergence}_{min_divergence:g}_{max_divergence:g}.npy')
+        if path is not None and os.path.exists(path):
+            self.table = np.load(path)
+        else:
+            mu_refs = np.arange(n_mu + 1) / n_mu
+            # xtol of sup_KL added so that tabulated values are upper bounds of the exact root
+            self.table = np.minimum(sup_KL(mu_refs[:, None], self.divergences[None, :]) + 2e-12, 1.0)
+            if path is not None:
+                mkdirs(directory)
+                with tempfile.NamedTemporaryFile(dir=directory, suffix='.npy', delete=False) as f:
+                    np.save(f, self.table)
+                os.chmod(f.name, 0o644)
+                os.replace(f.name, path)  # never leave a partial file at path
+
+    def sup_KL(self, mu_ref, divergence) -> np.ndarray:
+        """ upper bound of sup_KL elementwise for arrays by table lookup """
+        mu_ref, divergence = np.broadcast_arrays(np.asarray(mu_ref, dtype=float), np.asarray(divergence, dtype=float))
+        i = np.minimum(np.ceil(mu_ref * self.n_mu).astype(int), self.n_mu)
+        i += (i < self.n_mu) & (i / self.n_mu < mu_ref)  # against rounding of mu_ref * n_mu
+        j = np.searchsorted(self.divergences, divergence)
+        inside = (0 < divergence) & (j < len(self.divergences))
+        result = np.where(divergence <= 0, mu_ref, 1.0)
+        i, j, d = i[inside], j[inside], divergence[inside]
+        upper = self.table[i, j]
+        # tangent of sup_KL(mu_i, .) at the lower divergence, with slope 1 / (d/dmu KL(mu_i, mu)) at its value mu
+        lower = j > 0
+        mu_i, mu_lo, d_lo = i[lower] / self.n_mu, self.table[i[lower], j[lower] - 1], self.divergences[j[lower] - 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = mu_lo * (1 - mu_lo) / (mu_lo - mu_i)
+            tangent = mu_lo + slope * (d[lower] - d_lo) + 2e-12
+        upper[lower] = np.where(mu_lo > mu_i, np.minimum(tangent, upper[lower]), upper[lower])
+        # a Newton step from above the root of KL(mu_ref, .) - divergence, convex and increasing there, stays above it
+        p, epsilon = mu_ref[inside], 1e-12
+        with np.errstate(divide='ignore', invalid='ignore'):
+            g = p * np.log((p + epsilon) / (upper + epsilon)) + (1 - p) * np.log((1 - p + epsilon) / (1 - upper + epsilon)) - d
+            dg = (1 - p) / (1 - upper + epsilon) - p / (upper + epsilon)
+            newton = upper - g / dg + 2e-12
+        result[inside] = np.where((g > 0) & (dg > 0) & (newton < upper), newton, upper)
+        outside = ~inside & (divergence > 0)
+        if np.any(outside):
+            result[outside] = sup_KL(mu_ref[outside], divergence[outside])
+        return result
+
+
+class LookAheadIndices:
+    """
+    Indices index(mu_hat, f(t) / N) of K arms at rounds t in order, for a nondecreasing f, as far as their maximum needs.
+    Each index is kept evaluated ahead at a later round (t // 8 rounds later, up to step), an upper bound of it until then,
+    in a heap keyed by (-bound, arm). Each round evaluates the indices of the arm at the top of the heap and of the arms pulled
+    (or whose bounds expired) since, and then of the arms popped from the top whose bounds reach the largest of those, so
+    that the maximum and its ties are those of all indices without visiting all K arms. mu_hat and N are shared arrays,
+    where update(arm) tells that the arm was pulled.
+    """
+
+    def __init__(self, mu_hat: np.ndarray, N: np.ndarray, f, step: int, index=sup_KL, margin=2e-9):
+        self.mu_hat, self.N, self.f, self.step, self.index = mu_hat, N, f, step, index
+        self.margin = margin  # bounds reach an index if within margin, far above the error of sup_KL at xtol
+        self.heap = []  # (-bound, arm, round up to which it is a bound), outdated ones left behind
+        self.ahead_t = [-1] * len(N)  # the round of the current heap entry of each arm, -1 if stale
+        self.stale = list(range(len(N)))  # arms whose look-ahead values are to be evaluated
+        self.expiring = deque()  # (round, arms) up to which look-ahead values evaluated together are bounds
+
+    def _top(self):
+        """ the current entry at the top of the heap, dropping outdated ones, or None if empty """
+        heap, ahead_t = self.heap, self.ahead_t
+        while heap and ahead_t[heap[0][1]] != heap[0][2]:
+            heapq.heappop(heap)
+        if len(heap) > 4 * len(ahead_t):  # mostly outdated entries
+            heap[:] = [entry for entry in heap if ahead_t[entry[1]] == entry[2]]
+            heapq.heapify(heap)
+        return heap[0] if heap else None
+
+    def _evaluate(self, arms: list, fvals) -> list:
+        return self.index(self.mu_hat[arms], fvals / self.N[arms]).tolist()
+
+    def at(self, t: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ arms and their indices at round t that can have the largest index, in the order of arms """
+        while self.expiring and self.expiring[0][0] < t:
+            ahead_t, arms = self.expiring.popleft()
+            for arm in arms:
+                if self.ahead_t[arm] == ahead_t:
+                    self.update(arm)
+        stale, self.stale = self.stale, []
+        top = self._top()
+        tops = [] if top is None else [top[1]]
+
+        # look-ahead values and indices of the stale arms, and the index of the top one, at once
+        ahead_t, fval = t + min(max(t // 8, 1), self.step), float(self.f(t))  # bounds tight as f(t) grows slowly
+        values = self._evaluate(stale + stale + tops, np.repeat([float(self.f(ahead_t)), fval],
+                                                                [len(stale), len(stale) + len(tops)]))
+        for arm, bound in zip(stale, values):
+            self.ahead_t[arm] = ahead_t
+            heapq.heappush(self.heap, (-bound, arm, ahead_t))
+        if stale:
+            self.expiring.append((ahead_t, stale))
+        indices = dict(zip(stale + tops, values[len(stale):]))
+
+        # the arms whose bounds reach the largest index so far, popped and then pushed back
+        best, popped = max(indices.values()) - self.margin, []
+        while self._top() is not None and -self.heap[0][0] >= best:
+            popped.append(heapq.heappop(self.heap))
+        for entry in popped:
+            heapq.heappush(self.heap, entry)
+        more = [arm for _, arm, _ in popped if arm not in indices]
+        if more:
+            indices.update(zip(more, self._evaluate(more, fval)))
+        arms = sorted(indices)
+        return np.array(arms, dtype=int), np.array([indices[arm] for arm in arms])
+
+    def update(self, arm: int):
+        """ the arm was pulled, hence its look-ahead value is stale """
+        if self.ahead_t[arm] >= 0:  # not stale already, e.g., pulled again
+            self.ahead_t[arm] = -1
+            self.stale.append(arm)
 
 
 def default_kl_UCB_func(t, value_at_small_t=1):
@@ -76,101 +432,434 @@ def default_kl_UCB_func(t, value_at_small_t=1):
         return np.log(t) + 3 * np.log(np.log(t))
 
 
-def kl_UCB(T: int, mu, f=None, seed=None, faster=True, prior_SF=None, **_kwargs):
-    """Bernoulli kl-UCB"""
-    if f is None:
-        f = default_kl_UCB_func
+def _pull_batch(mu, uniforms: VariateBlocks, arms: np.ndarray, envs) -> np.ndarray:
+    """ rewards of pulling arms[b] in the b-th trial, with the next uniform of its rewards stream """
+    if envs is None:
+        return (uniforms.take_one() <= mu[arms]).astype(float)
+    return np.array([env.pull(arm_x) for env, arm_x in zip(envs, arms.tolist())], dtype=float)
 
-    K_ = len(mu)
-    faster = faster and K_ > 4
-    N, mu_hat = np.zeros((K_,)), np.zeros((K_,))
-    if prior_SF is not None:
-        S, F = prior_SF
-        for arm in range(K_):
-            N[arm] = S[arm] + F[arm]
-            mu_hat[arm] = S[arm] / (S[arm] + F[arm])
 
-    ukeeper = U_keeper(K_, T)
+class Policy(abc.ABC):
+    """
+    Bandit algorithm playing a batch of trials at once with the state of all trials as (trials x K) arrays, where select
+    gives the arm of each trial at round t and update takes their rewards. The randomness of the b-th trial only comes
+    from streams[b] of trial_streams, in blocks of block_size variates per stream for all trials, and each trial draws
+    as if it were played alone. prior_SF gives successes and failures of each arm observed before, e.g., in other trials.
+    """
 
-    mu = [m / 3 for m in mu]
+    def __init__(self, K: int, streams, block_size=BLOCK_SIZE, prior_SF=None):
+        self.n_trials = len(streams)
+        self.K = K
+        self.streams = streams
+        self.block_size = max(block_size // self.n_trials, 1)
+        self.rngs = [stream[1] for stream in streams]
+        self.noise = VariateBlocks([stream[2] for stream in streams], _uniforms, self.block_size)
+        self.rows = np.arange(self.n_trials)
+        self.offsets = self.rows * K  # of the rows of (trials x K) arrays flattened
+        self.ties = np.zeros(K, dtype=bool)  # buffer of _rand_argmax_rows
+        prior_SF = (np.zeros(K), np.zeros(K)) if prior_SF is None else prior_SF
+        self.prior_S, self.prior_F = np.asarray(prior_SF[0], dtype=float), np.asarray(prior_SF[1], dtype=float)
 
-    arms_selected = np.zeros((T,)).astype(int)
-    rewards = np.zeros((T,))
-    with seeded(seed):
-        rands = np.random.rand(T)
-        shuffled_arms = np.random.choice(K_, K_, replace=False)
-        for t, arm_x in enumerate(shuffled_arms):
-            reward_y = int(rands[t] <= mu[arm_x])
-            N[arm_x] += 1
-            mu_hat[arm_x] += (reward_y - mu_hat[arm_x]) / N[arm_x]
+    def prior_means(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ (trials x K) counts and means of the prior successes and failures, with means 0 for arms without any """
+        N = np.tile(self.prior_S + self.prior_F, (self.n_trials, 1))
+        mu_hat = np.divide(np.tile(self.prior_S, (self.n_trials, 1)), N, out=np.zeros_like(N), where=N > 0)
+        return N, mu_hat
 
-            arms_selected[t] = arm_x
-            rewards[t] = reward_y
+    @abc.abstractmethod
+    def select(self, t: int) -> np.ndarray:
+        """ arms of all trials at round t """
 
-        U = np.array([sup_KL(mu_hat[i], f(K_) / N[i]) for i in range(K_)])
+    @abc.abstractmethod
+    def update(self, t: int, arms: np.ndarray, rewards: np.ndarray):
+        """ rewards of the arms of all trials at round t """
 
-        # compute
-        for t in range(K_, T):
-            arm_x = rand_argmax(U)
-            # select
-            reward_y = int(rands[t] <= mu[arm_x])
 
-            arms_selected[t] = arm_x
-            rewards[t] = reward_y
+def _update_means(N: np.ndarray, mu_hat: np.ndarray, entries: np.ndarray, rewards: np.ndarray):
+    """ counts and running means of (trials x K) N and mu_hat with rewards at entries of them flattened """
+    N, mu_hat = N.reshape(-1), mu_hat.reshape(-1)
+    counts, means = N[entries] + 1, mu_hat[entries]
+    N[entries] = counts
+    mu_hat[entries] = means + (rewards - means) / counts
 
-            # update for next
-            N[arm_x] += 1
-            mu_hat[arm_x] += (reward_y - mu_hat[arm_x]) / N[arm_x]
 
-            if not faster:
-                fval = f(t + 1)
-                U = np.array([sup_KL(mu_hat[i], fval / N[i]) for i in range(K_)])
-            else:
-                ukeeper.update_U(t + 1, f, mu_hat, N, U, arm_x)
+POLICIES = dict()
+
+
+def register(name: str):
+    """ class decorator adding a Policy to POLICIES by name, so that simulate and play_bandits can play it """
+    def decorator(cls):
+        POLICIES[name] = cls
+        return cls
+    return decorator
+
+
+def policy_of(algo: str):
+    if algo not in POLICIES:
+        raise AssertionError(f'unknown algo: {algo}')
+    return POLICIES[algo]
+
+
+@register('TS')
+class ThompsonSamplingPolicy(Policy):
+    """ Thompson sampling with Beta(S + 1, F + 1) posteriors of all trials sampled at once, S and F from prior_SF if given """
+
+    def __init__(self, K, streams, block_size=BLOCK_SIZE, prior_SF=None):
+        super().__init__(K, streams, block_size, prior_SF)
+        B = self.n_trials
+        self.alpha_beta = np.ones((B, 2 * K))
+        self.alpha, self.beta = self.alpha_beta[:, :K], self.alpha_beta[:, K:]
+        self.alpha += self.prior_S
+        self.beta += self.prior_F
+        self.gammas, self.theta = np.zeros((B, 2 * K)), np.zeros((B, K))
+        self.normals = VariateBlocks([stream[3] for stream in streams], _normals, max(self.block_size, 8 * K))
+        self.uniforms = VariateBlocks([stream[4] for stream in streams], _uniforms, max(self.block_size, 8 * K))
+
+    def select(self, t):
+        _standard_gamma(self.alpha_beta, self.normals, self.uniforms, out=self.gammas)
+        gamma_S, gamma_F = self.gammas[:, :self.K], self.gammas[:, self.K:]
+        np.add(gamma_S, gamma_F, out=self.theta)
+        np.divide(gamma_S, self.theta, out=self.theta)
+        return _rand_argmax_rows(self.theta, self.noise, self.ties)
+
+    def update(self, t, arms, rewards):
+        alpha_beta, entries = self.alpha_beta.reshape(-1), self.offsets * 2 + arms
+        alpha_beta[entries] += rewards
+        alpha_beta[entries + self.K] += 1 - rewards
+
+
+@register('UCB')
+class KLUCBPolicy(Policy):
+    """ kl-UCB, playing every arm once in a random order (after S and F of prior_SF if given), with indices looked up in table if given """
+
+    def __init__(self, K, streams, block_size=BLOCK_SIZE, f=None, faster=True, prior_SF=None, table: SupKLTable = None):
+        super().__init__(K, streams, block_size, prior_SF)
+        self.f = default_kl_UCB_func if f is None else f
+        self.index = sup_KL if table is None else table.sup_KL
+        self.N, self.mu_hat = self.prior_means()
+        self.shuffled_arms = np.array([rng.permutation(K) for rng in self.rngs]).reshape(self.n_trials, K)
+        self.indices = None
+        if faster and table is None and self.n_trials == 1:
+            self.indices = LookAheadIndices(self.mu_hat[0], self.N[0], self.f, step=2 * K)
+
+    def select(self, t):
+        if t < self.K:
+            return self.shuffled_arms[:, t]
+        if self.indices is not None:
+            arms, indices = self.indices.at(t)
+            return arms[[_rand_argmax(indices, self.noise.next, self.ties[:len(indices)])]]
+        return _rand_argmax_rows(self.index(self.mu_hat, self.f(t) / self.N), self.noise, self.ties)
+
+    def update(self, t, arms, rewards):
+        _update_means(self.N, self.mu_hat, self.offsets + arms, rewards)
+        if self.indices is not None:
+            self.indices.update(arms.item())
+
+
+@register('EpsGreedy')
+class EpsilonGreedyPolicy(Policy):
+    """ an arm uniformly at random with probability epsilon, otherwise the best empirical mean (every arm first) """
+
+    def __init__(self, K, streams, block_size=BLOCK_SIZE, epsilon=0.1, prior_SF=None):
+        super().__init__(K, streams, block_size, prior_SF)
+        self.epsilon = epsilon
+        self.N, self.mu_hat = self.prior_means()
+
+    def select(self, t):
+        explore = self.noise.take_one() < self.epsilon
+        arms = np.zeros((self.n_trials,), dtype=int)
+        arms[explore] = (self.noise.take(explore.astype(int)) * self.K).astype(int)
+        greedy = np.flatnonzero(~explore)
+        arms[greedy] = _rand_argmax_rows(np.where(self.N[greedy] > 0, self.mu_hat[greedy], np.inf), self.noise, self.ties, greedy)
+        return arms
+
+    def update(self, t, arms, rewards):
+        _update_means(self.N, self.mu_hat, self.offsets + arms, rewards)
+
+
+@register('SWTS')
+class SlidingWindowTSPolicy(ThompsonSamplingPolicy):
+    """ Thompson sampling with posteriors from the rewards of the last window rounds only, for non-stationary rewards """
+
+    def __init__(self, K, streams, block_size=BLOCK_SIZE, window=1000, prior_SF=None):
+        super().__init__(K, streams, block_size, prior_SF)  # the prior is never forgotten
+        self.window = window
+        self.history_arms = np.zeros((self.n_trials, window), dtype=int)
+        self.history_rewards = np.zeros((self.n_trials, window))
+
+    def update(self, t, arms, rewards):
+        if t >= self.window:  # forget the round leaving the window
+            old_arms, old_rewards = self.history_arms[:, t % self.window], self.history_rewards[:, t % self.window]
+            self.alpha[self.rows, old_arms] -= old_rewards
+            self.beta[self.rows, old_arms] -= 1 - old_rewards
+        self.history_arms[:, t % self.window] = arms
+        self.history_rewards[:, t % self.window] = rewards
+        super().update(t, arms, rewards)
+
+
+@register('DUCB')
+class DiscountedUCBPolicy(Policy):
+    """ Discounted UCB (Garivier and Moulines, 2011) with counts and sums discounted by gamma every round """
+
+    def __init__(self, K, streams, block_size=BLOCK_SIZE, gamma=0.999, xi=0.5, prior_SF=None):
+        super().__init__(K, streams, block_size, prior_SF)
+        self.gamma, self.xi = gamma, xi
+        # the prior is discounted as if observed right before the first round
+        self.N = np.tile(self.prior_S + self.prior_F, (self.n_trials, 1))
+        self.S = np.tile(self.prior_S, (self.n_trials, 1))
+
+    def select(self, t):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n = np.sum(self.N, axis=1, keepdims=True)
+            U = self.S / self.N + 2 * np.sqrt(self.xi * np.log(np.maximum(n, 1)) / self.N)
+        return _rand_argmax_rows(np.where(self.N > 0, U, np.inf), self.noise, self.ties)
+
+    def update(self, t, arms, rewards):
+        self.N *= self.gamma
+        self.S *= self.gamma
+        self.N[self.rows, arms] += 1
+        self.S[self.rows, arms] += rewards
+
+
+def simulate(algo: str, T: int, mu, seeds, envs=None, block_size=BLOCK_SIZE, **options) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    len(seeds) trials played at once by the policy registered as algo (with options), as (trials x T) arms and rewards,
+    where rewards come from envs[b] if given. Each trial draws from trial_streams of its seed only, hence it is the same
+    whichever trials it is played with and whatever block_size (variates pregenerated per stream for all trials) is.
+    """
+    B, K_ = len(seeds), len(mu) if envs is None else len(envs[0])
+    mu = np.asarray(mu) / 3 if envs is None else None
+    streams = [trial_streams(seed) for seed in seeds]
+    uniforms = VariateBlocks([stream[0] for stream in streams], _uniforms, min(T, max(block_size // B, 1)))
+    policy = policy_of(algo)(K_, streams, block_size, **options)
+
+    arms_selected, rewards = np.zeros((B, T), dtype=int), np.zeros((B, T))
+    for t in range(T):
+        arms = policy.select(t)
+        reward_y = _pull_batch(mu, uniforms, arms, envs)
+
+        arms_selected[:, t] = arms
+        rewards[:, t] = reward_y
+        policy.update(t, arms, reward_y)
 
     return arms_selected, rewards
 
 
-def thompson_sampling(T: int, mu, seed=None, prior_SF=None, **_kwargs):
-    """ Bernoulli Thompson Sampling with known mu"""
-    K_ = len(mu)
-    S, F, theta = np.zeros((K_,)), np.zeros((K_,)), np.zeros((K_,))
-    if prior_SF is not None:
-        S, F = prior_SF
+def thompson_sampling_batch(T: int, mu, seeds, envs=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    thompson_sampling for len(seeds) trials at once with (trials x K) posteriors, where rewards come from envs[b] if given.
+    Each trial is the same as thompson_sampling with its seed.
+    """
+    return simulate('TS', T, mu, seeds, envs)
 
-    arms_selected = np.zeros((T,)).astype(int)
-    rewards = np.zeros((T,))
-    mu = [m / 3 for m in mu]
-    with seeded(seed):
-        random_numbers = np.random.rand(T)
-        print(f"[Thompson] Seed={seed}, Start!")
 
-        for t in range(T):
-            theta = [beta(S[i] + 1, F[i] + 1) for i in range(K_)]
-            arm_x = rand_argmax(theta)
+def kl_UCB_batch(T: int, mu, seeds, f=None, envs=None, faster=True, table: SupKLTable = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    kl_UCB for len(seeds) trials at once with (trials x K) statistics, where rewards come from envs[b] if given.
+    Each trial is the same as kl_UCB with its seed and faster.
+    """
+    return simulate('UCB', T, mu, seeds, envs, f=f, faster=faster, table=table)
 
-            reward_y = int(random_numbers[t] <= mu[arm_x])
 
-            arms_selected[t] = arm_x
-            rewards[t] = reward_y
+def kl_UCB(T: int, mu, f=None, seed=None, faster=True, prior_SF=None, env=None, table: SupKLTable = None, block_size=BLOCK_SIZE, **_kwargs):
+    """Bernoulli kl-UCB, with rewards pulled from env (e.g., SCMEnvironment) instead of mu if given,
+    and indices looked up in table instead of computed by sup_KL if given.
+    faster keeps indices in LookAheadIndices (for a nondecreasing f) rather than computing all of them every round, with
+    the same maxima and ties, for a trial played alone (batches compute them all at once in a single call of sup_KL).
+    This is a trial of simulate('UCB', ...) with randomness from trial_streams(seed)."""
+    arms_selected, rewards = simulate('UCB', T, mu, [seed], None if env is None else [env], block_size,
+                                      f=f, faster=faster, prior_SF=prior_SF, table=table)
+    return arms_selected[0], rewards[0]
 
-            if reward_y == 1:
-                S[arm_x] += 1
-            else:
-                F[arm_x] += 1
-        print(f"[Thompson] Seed={seed}, Done!")
 
-    return arms_selected, rewards
+def thompson_sampling(T: int, mu, seed=None, prior_SF=None, env=None, block_size=BLOCK_SIZE, **_kwargs):
+    """
+    Bernoulli Thompson Sampling with known mu, or rewards pulled from env (e.g., SCMEnvironment) if given.
+
+    This is a trial of simulate('TS', ...), where randomness comes from trial_streams(seed) in blocks of block_size, a
+    uniform for the reward of each round, and each round K gamma variates for successes and K for failures
+    (theta = G_S / (G_S + G_F) as Beta(S + 1, F + 1)), and a uniform to pick among arms with the same theta only if
+    there is a tie.
+    """
+    label = seed.spawn_key if isinstance(seed, np.random.SeedSequence) else seed
+    print(f"[Thompson] Seed={label}, Start!")
+    arms_selected, rewards = simulate('TS', T, mu, [seed], None if env is None else [env], block_size, prior_SF=prior_SF)
+    print(f"[Thompson] Seed={label}, Done!")
+
+    return arms_selected[0], rewards[0]
+
 
 # arm_played, rewards = play_bandits(horizon, subseq(mu, arm_selected), bandit_algo, num_trial, n_jobs)
-def play_bandits(T: int, mu, algo: str, repeat: int, n_jobs=1) -> Tuple[np.ndarray, np.ndarray]:
-    if algo == 'TS': #  backend="threading", verbose=100
-        par_result = Parallel(n_jobs=n_jobs, verbose=100)(delayed(thompson_sampling)(T, mu, seed=trial) for trial in range(repeat))
-    elif algo == 'UCB':
-        par_result = Parallel(n_jobs=n_jobs, verbose=100)(delayed(kl_UCB)(T, mu, seed=trial) for trial in range(repeat))
-    else:
-        raise AssertionError(f'unknown algo: {algo}')
+def play_bandits(T: int, mu, algo: str, repeat: int, n_jobs=1, env=None, batch_size=None, seed=0, **options) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    algo is a name in POLICIES with options (e.g., table for 'UCB'), where each task plays batch_size trials at once by
+    simulate, by default as many as spread the trials over the jobs up to BATCH_SIZE. The trials are seeded by
+    trial_seeds(seed, repeat), e.g., seed_of(0, strategy, algo), which gives the same trials whatever batch_size is.
+    env, if given, builds the environment of a trial from its seed in the worker, e.g.,
+    functools.partial(SCMEnvironment.of, model_factory, Ys, interventions).
+    """
+    policy_of(algo)
+    seeds = trial_seeds(seed, repeat)
+    batch_size = with_default(batch_size, min(BATCH_SIZE, max(-(-repeat // effective_n_jobs(n_jobs)), 1)))
+    batches = [seeds[start:start + batch_size] for start in range(0, repeat, batch_size)]
+    par_result = Parallel(n_jobs=n_jobs, verbose=100)(delayed(_play_batch)(algo, T, mu, batch, env, **options) for batch in batches)
 
     return (np.vstack(tuple(arms_selected for arms_selected, _ in par_result)),
             np.vstack(tuple(rewards for _, rewards in par_result)))
 
+
+def _play_batch(algo: str, T: int, mu, seeds, env=None, **options):
+    return simulate(algo, T, mu, list(seeds), envs=None if env is None else [env(seed=seed) for seed in seeds], **options)
+
+
+class OnlineAgent:
+    """
+    Bandit algorithm serving live requests over arms given by their ids (e.g., ns_arms_of), where select() gives the arm id
+    for a request, select(n) the arm ids for n concurrent requests, and update(arm, reward) takes a reward whenever it comes back.
+    state() is a JSON-serializable snapshot from which from_state restores the agent including its random stream.
+    """
+
+    def __init__(self, arms, seed=None):
+        self.arms = np.asarray(arms)
+        self.K = len(self.arms)
+        self.position = {arm: i for i, arm in enumerate(self.arms.tolist())}
+        self.rng = np.random.default_rng(seed)
+        self.ties = np.zeros((self.K,), dtype=bool)
+
+    def state(self) -> dict:
+        return {'arms': self.arms.tolist(), 'rng': self.rng.bit_generator.state}
+
+    @classmethod
+    def from_state(cls, state: dict, **options):
+        agent = cls(state['arms'], **options)
+        agent.rng.bit_generator.state = state['rng']
+        return agent
+
+
+class ThompsonSamplingAgent(OnlineAgent):
+    """ online Bernoulli Thompson sampling, where select(n) draws n posterior samples of each arm at once """
+
+    def __init__(self, arms, seed=None, prior_SF=None):
+        super().__init__(arms, seed)
+        self.alpha, self.beta = np.ones((self.K,)), np.ones((self.K,))
+        if prior_SF is not None:
+            S, F = prior_SF
+            self.alpha += S
+            self.beta += F
+        self.gamma_S, self.gamma_F, self.theta = np.zeros((self.K,)), np.zeros((self.K,)), np.zeros((self.K,))
+        self._grow(0)
+
+    def _grow(self, n: int):
+        """ buffers for select(n), grown to the largest n so far """
+        self.block, self.block_ties = np.zeros((3, n, self.K)), np.zeros((n, self.K), dtype=bool)
+        self.picks, self.n_ties, self.best = np.zeros((n,), dtype=int), np.zeros((n,), dtype=int), np.zeros((n, 1))
+
+    def select(self, n: int = None):
+        if n is None:
+            self.rng.standard_gamma(self.alpha, out=self.gamma_S)
+            self.rng.standard_gamma(self.beta, out=self.gamma_F)
+            np.add(self.gamma_S, self.gamma_F, out=self.theta)
+            np.divide(self.gamma_S, self.theta, out=self.theta)
+            return self.arms[_rand_argmax(self.theta, self.rng.random, self.ties)].item()
+
+        if self.block.shape[1] < n:
+            self._grow(n)
+        gamma_S, gamma_F, theta = self.block[:, :n]
+        ties, picks, n_ties, best = self.block_ties[:n], self.picks[:n], self.n_ties[:n], self.best[:n]
+        self.rng.standard_gamma(self.alpha, out=gamma_S)
+        self.rng.standard_gamma(self.beta, out=gamma_F)
+        np.add(gamma_S, gamma_F, out=theta)
+        np.divide(gamma_S, theta, out=theta)
+        # _rand_argmax of each row, drawing a uniform only for (the rare) rows with ties, in order
+        theta.argmax(axis=1, out=picks)
+        np.equal(theta, theta.max(axis=1, keepdims=True, out=best), out=ties)
+        ties.sum(axis=1, out=n_ties)
+        for row in np.flatnonzero(n_ties > 1).tolist():
+            picks[row] = np.flatnonzero(ties[row])[int(self.rng.random() * n_ties[row])]
+        return self.arms[picks]
+
+    def update(self, arm, reward):
+        i = self.position[arm]
+        self.alpha[i] += reward
+        self.beta[i] += 1 - reward
+
+    def state(self) -> dict:
+        return {**super().state(), 'S': (self.alpha - 1).tolist(), 'F': (self.beta - 1).tolist()}
+
+    @classmethod
+    def from_state(cls, state: dict, **options):
+        return super().from_state(state, prior_SF=(state['S'], state['F']), **options)
+
+
+class KLUCBAgent(OnlineAgent):
+    """
+    online Bernoulli kl-UCB, where select(n) gives the arms of the n largest indices (cycling if n > K), and arms without
+    rewards come first. select() evaluates the few indices it needs in LookAheadIndices, once per update, where update
+    evaluates the look-ahead index of the arm, unless indices are looked up in table (SupKLTable). Otherwise, and for
+    select(n), all indices are recomputed into U by the first select after updates.
+    """
+
+    def __init__(self, arms, seed=None, prior_SF=None, f=None, table: SupKLTable = None):
+        super().__init__(arms, seed)
+        self.f = default_kl_UCB_func if f is None else f
+        self.index = sup_KL if table is None else table.sup_KL
+        self.N, self.mu_hat = np.zeros((self.K,)), np.zeros((self.K,))
+        if prior_SF is not None:
+            S, F = np.asarray(prior_SF[0], dtype=float), np.asarray(prior_SF[1], dtype=float)
+            np.add(S, F, out=self.N)
+            np.divide(S, self.N, out=self.mu_hat, where=self.N > 0)
+        self.t = int(self.N.sum())
+        self.unplayed = int(np.count_nonzero(self.N == 0))
+        self.indices = None if table is not None else LookAheadIndices(self.mu_hat, self.N, self.f, step=2 * self.K)
+        self.indices_t = -1  # the round at which indices were last evaluated
+        self.U, self.noise, self.rank = np.zeros((self.K,)), np.zeros((self.K,)), np.zeros((self.K,), dtype=int)
+        self.stale = True
+
+    def _refresh(self):
+        with np.errstate(divide='ignore'):
+            np.divide(self.f(self.t), self.N, out=self.U)
+        self.U[:] = self.index(self.mu_hat, self.U)
+        np.copyto(self.U, np.inf, where=np.equal(self.N, 0, out=self.ties))
+        self.stale = False
+
+    def select(self, n: int = None):
+        if n is None and self.unplayed:
+            np.equal(self.N, 0, out=self.ties)
+            k = int(self.rng.random() * self.unplayed) if self.unplayed > 1 else 0
+            return self.arms[np.cumsum(self.ties, out=self.rank).searchsorted(k + 1)].item()
+        if n is None and self.indices is not None:
+            if self.indices_t != self.t:
+                self.candidates, self.candidate_indices = self.indices.at(self.t)
+                self.indices_t = self.t
+            i = _rand_argmax(self.candidate_indices, self.rng.random, self.ties[:len(self.candidates)])
+            return self.arms[self.candidates[i]].item()
+        if self.stale:
+            self._refresh()
+        if n is None:
+            return self.arms[_rand_argmax(self.U, self.rng.random, self.ties)].item()
+        # ranked by index and then by noise, as far as the min(n, K) largest indices and their ties
+        self.rng.random(out=self.noise)
+        m = min(n, self.K)
+        threshold = self.U[self.U.argpartition(self.K - m)[self.K - m]]
+        candidates = np.flatnonzero(np.greater_equal(self.U, threshold, out=self.ties))
+        ranked = candidates[np.lexsort((self.noise[candidates], -self.U[candidates]))[:m]]
+        return self.arms[ranked[np.arange(n) % m]]
+
+    def update(self, arm, reward):
+        i = self.position[arm]
+        if self.N[i] == 0:
+            self.unplayed -= 1
+        self.t += 1
+        self.N[i] += 1
+        self.mu_hat[i] += (reward - self.mu_hat[i]) / self.N[i]
+        if self.indices is not None:
+            self.indices.update(i)
+        self.stale = True
+
+    def state(self) -> dict:
+        S = self.mu_hat * self.N
+        return {**super().state(), 'S': S.tolist(), 'F': (self.N - S).tolist()}
+
+    @classmethod
+    def from_state(cls, state: dict, **options):
+        return super().from_state(state, prior_SF=(state['S'], state['F']), **options)
@@ -1,26 +1,205 @@
 import itertools
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from itertools import product
 
 import functools
+import hashlib
+import re
+import sys
+import types
 import networkx as nx
 import numpy as np
-from typing import Dict, Iterable, Optional, Set, Sequence, AbstractSet
+from typing import Dict, Iterable, Iterator, Optional, Set, Sequence, AbstractSet
 from typing import FrozenSet, Tuple
 
 from npsem.utils import fzset_union, sortup, sortup2, with_default
 
 
-def default_P_U(mu: Dict):
-    """ P(U) function given a dictionary of probabilities for each U_i being 1, P(U_i=1) """
+class ProductP_U:
+    """ P(U) = prod_i P(U_i) given a dictionary of categorical distributions {u_i: P(U_i=u_i)} for each U_i """
+
+    def __init__(self, factors: Dict[str, Dict]):
+        self.factors = {U_i: dict(factor) for U_i, factor in factors.items()}
+        self._tables = dict()
+        for U_i, factor in self.factors.items():
+            values = np.array(sorted(factor))
+            probs = np.array([factor[u_i] for u_i in values.tolist()] + [0.0])  # 0 for values out of the factor
+            self._tables[U_i] = values, probs
 
-    def P_U(d):
+    def __call__(self, d) -> float:
         p_val = 1.0
-        for k in mu.keys():
-            p_val *= (1 - mu[k]) if d[k] == 0 else mu[k]
+        for U_i, factor in self.factors.items():
+            p_val *= factor.get(d[U_i], 0.0)
         return p_val
 
-    return P_U
+    def support(self, U_i: str, domain: Sequence) -> Tuple:
+        """ values of the domain of U_i with non-zero probability """
+        if U_i not in self.factors:
+            return tuple(domain)
+        return tuple(u_i for u_i in domain if self.factors[U_i].get(u_i, 0.0) != 0)
+
+    def factor_probs(self, U_i: str, column: np.ndarray) -> np.ndarray:
+        values, probs = self._tables[U_i]
+        index = np.minimum(np.searchsorted(values, column), len(values) - 1)
+        index[values[index] != column] = len(values)
+        return probs[index]
+
+    def prob(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """ P(U) of every row of the columns, where U_i not in the columns are summed out """
+        p_u = np.ones(len(next(iter(columns.values()))) if columns else 1)
+        for U_i in sortup(columns.keys() & self.factors.keys()):
+            p_u *= self.factor_probs(U_i, columns[U_i])
+        return p_u
+
+    def sample(self, U: Iterable[str], n: int, rng: np.random.Generator, D: Dict = None) -> Dict[str, np.ndarray]:
+        """ n independent draws of U as columns, where U_i without a factor is unweighted, i.e., uniform over D[U_i] """
+        columns = dict()
+        for U_i in sortup(U):
+            if U_i not in self.factors:
+                if D is None:
+                    raise AssertionError(f'no factor nor domain for {U_i}')
+                columns[U_i] = np.asarray(D[U_i])[rng.integers(len(D[U_i]), size=n)]
+                continue
+            values, probs = self._tables[U_i]
+            index = np.searchsorted(np.cumsum(probs[:-1]), rng.random(n), side='right')
+            columns[U_i] = values[np.minimum(index, len(values) - 1)]  # guards against rounding of the cumulative sum
+        return columns
+
+    def log_prob(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """ log P(U) of every row of the columns, where U_i not in the columns are summed out """
+        keys = sortup(columns.keys() & self.factors.keys())
+        if not keys:
+            return np.zeros(len(next(iter(columns.values()))) if columns else 1)
+        with np.errstate(divide='ignore'):
+            return np.sum(np.log([self.factor_probs(U_i, columns[U_i]) for U_i in keys]), axis=0)
+
+
+class BernoulliP_U(ProductP_U):
+    """ P(U) = prod_i P(U_i) given a dictionary of probabilities for each U_i being 1, P(U_i=1) """
+
+    def __init__(self, mu: Dict):
+        super().__init__({U_i: {0: 1 - mu_i, 1: mu_i} for U_i, mu_i in mu.items()})
+        self.mu = dict(mu)
+
+
+def default_P_U(mu: Dict) -> BernoulliP_U:
+    """ P(U) function given a dictionary of probabilities for each U_i being 1, P(U_i=1) """
+    return BernoulliP_U(mu)
+
+
+def code_fingerprint(f, _seen: FrozenSet = frozenset()) -> Tuple:
+    """
+    what a function computes, by its byte code, names, constants, closure and the globals it reads, without memory
+    addresses of nested code. Raises ValueError for values without a stable representation (see value_fingerprint).
+    """
+    if not isinstance(f, types.FunctionType):
+        return value_fingerprint(f, _seen),
+    closure = tuple(value_fingerprint(cell.cell_contents, _seen | {f.__code__}) for cell in f.__closure__ or ())
+    return _code_fingerprint(f.__code__, f.__globals__, _seen) + (closure,)
+
+
+def _code_fingerprint(code: types.CodeType, globals_: Dict, _seen: FrozenSet) -> Tuple:
+    """ code_fingerprint of a code object, of nested code as well, whose free variables are read from the closure """
+    if code in _seen:  # recursion
+        return code.co_name,
+    _seen = _seen | {code}
+    consts = tuple(_code_fingerprint(c, globals_, _seen) if isinstance(c, types.CodeType) else value_fingerprint(c, _seen)
+                   for c in code.co_consts)
+    # attribute names are among co_names as well, which only adds globals of the same names
+    names = tuple((name, value_fingerprint(globals_[name], _seen)) for name in code.co_names if name in globals_)
+    return code.co_code.hex(), code.co_names, code.co_freevars, consts, names
+
+
+def value_fingerprint(value, _seen: FrozenSet = frozenset()):
+    """
+    representation of a value identical in any process, with arrays hashed in full (repr truncates them) and functions
+    by code_fingerprint. Raises ValueError for values represented by their memory address.
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return 'ndarray', value.shape, tuple(value_fingerprint(v, _seen) for v in value.ravel().tolist())
+        return 'ndarray', value.dtype.str, value.shape, hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+    if isinstance(value, types.FunctionType):
+        return code_fingerprint(value, _seen)
+    if isinstance(value, types.MethodType):
+        return 'method', value_fingerprint(value.__self__, _seen), code_fingerprint(value.__func__, _seen)
+    if isinstance(value, functools.partial):
+        return ('partial', value_fingerprint(value.func, _seen), value_fingerprint(value.args, _seen),
+                value_fingerprint(value.keywords, _seen))
+    if isinstance(value, types.ModuleType):
+        return 'module', value.__name__
+    if isinstance(value, (tuple, list)):
+        return type(value).__name__, tuple(value_fingerprint(v, _seen) for v in value)
+    if isinstance(value, (set, frozenset)):  # of an order which varies with hash randomization
+        return type(value).__name__, tuple(sorted(repr(value_fingerprint(v, _seen)) for v in value))
+    if isinstance(value, dict):
+        return 'dict', tuple((value_fingerprint(k, _seen), value_fingerprint(v, _seen)) for k, v in value.items())
+    representation = repr(value)
+    if re.search(r' at 0x[0-9a-fA-F]+', representation):
+        raise ValueError(f'no stable representation: {representation}')
+    return representation
+
+
+class QueryCache:
+    """ Least-recently-used cache of query results bounded by the number of entries and/or their approximate bytes """
+
+    def __init__(self, max_entries: Optional[int] = 1024, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (probabilities, default value, bytes)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> Optional[defaultdict]:
+        if key not in self._entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        probs, default, _ = self._entries[key]
+        return defaultdict(lambda: default, probs)
+
+    def put(self, key, result: defaultdict):
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[2]
+        probs = dict(result)
+        nbytes = sys.getsizeof(key) + sys.getsizeof(probs) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in probs.items())
+        self._entries[key] = probs, result.default_factory(), nbytes
+        self.nbytes += nbytes
+        while self._entries and ((self.max_entries is not None and len(self._entries) > self.max_entries) or
+                                 (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            self.nbytes -= self._entries.popitem(last=False)[1][2]
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self._entries), 'bytes': self.nbytes}
+
+
+def product_columns(D, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+    """ All joint assignments of keys as one column per key, rows in the order of itertools.product """
+    grids = np.meshgrid(*[np.asarray(D[k]) for k in keys], indexing='ij')
+    return {k: grid.ravel() for k, grid in zip(keys, grids)}
+
+
+class KeyRecorder(dict):
+    """ dict which remembers the keys read through [] """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.keys_read = set()
+
+    def __getitem__(self, key):
+        self.keys_read.add(key)
+        return super().__getitem__(key)
 
 
 def dict_only(a_dict: dict, keys: AbstractSet) -> Dict:
@@ -425,24 +604,65 @@ class CausalDiagram:
             return f'[' + (', '.join(paths_string) + ' / ' + ', '.join(bipaths_string)) + ']'
 
 
+_model_ids = itertools.count()  # of models without a fingerprint
+
+
 class StructuralCausalModel:
-    def __init__(self, G: CausalDiagram, F=None, P_U=None, D=None, more_U=None):
+    def __init__(self, G: CausalDiagram, F=None, P_U=None, D=None, more_U=None, backend='python', query_cache: QueryCache = None,
+                 monte_carlo: dict = None):
+        """
+        backend 'numpy' evaluates F over columns of all exogenous assignments at once, hence F must work on arrays.
+        backend 'monte_carlo' estimates queries from batches of sampled exogenous columns instead, with F on arrays and P_U a ProductP_U,
+        where monte_carlo holds keyword arguments of query_monte_carlo (e.g., {'precision': 1e-3, 'max_samples': 10 ** 6}).
+        query_cache can be shared by models, whose entries are only shared if the models have the same fingerprint
+        (and never by models without one).
+        """
         self.G = G
         self.F = F
         self.P_U = P_U
         self.D = with_default(D, defaultdict(lambda: (0, 1)))
         self.more_U = set() if more_U is None else set(more_U)
-
-        self.query00 = functools.lru_cache(1024)(self.query00)
-
-    def query(self, outcome: Tuple, condition: dict = None, intervention: dict = None, verbose=False) -> defaultdict:
+        self.backend = backend
+        self.query_cache = with_default(query_cache, QueryCache())
+        self.monte_carlo = with_default(monte_carlo, dict())
+        self._exogenous_columns = dict()
+        self._U_pa = dict()
+        self._fingerprint = None
+
+    def query(self, outcome: Tuple, condition: dict = None, intervention: dict = None, verbose=False, backend=None) -> defaultdict:
         if condition is None:
             condition = dict()
         if intervention is None:
             intervention = dict()
+        outcome = tuple(outcome)
+        backend = with_default(backend, self.backend)
+        if backend == 'monte_carlo':
+            # estimates are not cached, so that they never stand in for exact results
+            return self.query_monte_carlo(outcome, condition, intervention, **self.monte_carlo)[0]
+        key = self.query_key(outcome, condition, intervention)
+        result = self.query_cache.get(key)
+        if result is not None:
+            return result
+
         new_condition = tuple(sorted([(x, y) for x, y in condition.items()]))
         new_intervention = tuple(sorted([(x, y) for x, y in intervention.items()]))
-        return self.query00(outcome, new_condition, new_intervention, verbose)
+        if backend == 'python':
+            result = self.query00(outcome, new_condition, new_intervention, verbose)
+        elif backend == 'numpy':
+            result = self.query_numpy(outcome, new_condition, new_intervention, verbose)
+        else:
+            raise AssertionError(f'unknown backend: {backend}')
+        self.query_cache.put(key, result)
+        return result
+
+    def query_key(self, outcome: Tuple, condition: dict, intervention: dict) -> Tuple:
+        """ cache key in which interventions on variables that affect neither the outcome nor the condition are dropped """
+        relevant = self.G.do(set(intervention)).An(set(outcome) | set(condition))
+        intervention = {x: v for x, v in intervention.items() if x in relevant}
+        if self._fingerprint is None:
+            # models without a fingerprint share entries with no other model
+            self._fingerprint = self.fingerprint() or ('model', next(_model_ids))
+        return self._fingerprint, outcome, sortup(condition.items()), sortup(intervention.items())
 
     def query00(self, outcome: Tuple, condition: Tuple, intervention: Tuple, verbose=False) -> defaultdict:
         condition = dict(condition)
@@ -453,28 +673,38 @@ class StructuralCausalModel:
         U = list(sorted(self.G.U | self.more_U))
         D = self.D
         P_U = self.P_U
-        V_ordered = self.G.causal_order()
+        # only ancestors of the outcome and the condition, where conditioned variables come as early as possible
+        V_ordered = self.evaluation_order(intervention, self.G.do(set(intervention)).An(set(outcome) | set(condition)), condition)
         if verbose:
             print(f"ORDER: {V_ordered}")
         normalizer = 0
 
-        for u in product(*[D[U_i] for U_i in U]):  # d^|U|
+        # with a known support (ProductP_U), zero-probability assignments are never enumerated, and P(U) is only
+        # computed for assignments agreeing with the condition; otherwise, they are skipped before evaluation
+        support = P_U.support if isinstance(P_U, ProductP_U) else None
+        domains = [support(U_i, D[U_i]) if support else D[U_i] for U_i in U]
+        # conditioned U take their conditioned value only, if possible at all
+        domains = [tuple(u_i for u_i in domain if u_i == condition[U_i]) if U_i in condition else domain
+                   for U_i, domain in zip(U, domains)]
+        for u in product(*domains):  # d^|U|
             assigned = dict(zip(U, u))
-            p_u = P_U(assigned)
+            p_u = None if support else P_U(assigned)
             if p_u == 0:
                 continue
 
-            # evaluate values
+            # evaluate values, rejecting the assignment as soon as it disagrees with the condition
             for V_i in V_ordered:
                 if V_i in intervention:
                     assigned[V_i] = intervention[V_i]
                 else:
                     assigned[V_i] = self.F[V_i](assigned)  # pa_i including unobserved
-
-            if not all(assigned[V_i] == condition[V_i] for V_i in condition):
-                continue
-            normalizer += p_u
-            prob_outcome[tuple(assigned[V_i] for V_i in outcome)] += p_u
+                if V_i in condition and assigned[V_i] != condition[V_i]:
+                    break
+            else:
+                if p_u is None:
+                    p_u = P_U(assigned)
+                normalizer += p_u
+                prob_outcome[tuple(assigned[V_i] for V_i in outcome)] += p_u
 
         if prob_outcome:
             # normalize by prob condition
@@ -482,6 +712,359 @@ class StructuralCausalModel:
         else:
             return defaultdict(lambda: np.nan)  # nan or 0?
 
+    def query_numpy(self, outcome: Tuple, condition: Tuple, intervention: Tuple, verbose=False) -> defaultdict:
+        """ query00 evaluated on columns, one row per assignment of U, instead of one assignment at a time """
+        condition = dict(condition)
+        intervention = dict(intervention)
+
+        # only U read by ancestors of the outcome and the condition in G_{\overline{X}}
+        Vs = self.G.do(set(intervention)).An(set(outcome) | set(condition))
+        U = self.relevant_U(Vs - set(intervention))
+        if verbose:
+            print(f"ORDER: {self.evaluation_order(intervention, Vs, condition)}")
+            print(f"U: {sortup(U)}")
+
+        p_u, assigned = self.evaluate_columns(intervention, Vs, U, condition)
+        normalizer = np.sum(p_u)
+
+        if not len(p_u):
+            return defaultdict(lambda: np.nan)  # nan or 0?
+        if not outcome:
+            return defaultdict(lambda: 0, {(): 1.0})
+        # normalize by prob condition
+        ys, inverse = np.unique(np.column_stack([assigned[V_i] for V_i in outcome]), axis=0, return_inverse=True)
+        prob_ys = np.bincount(inverse.ravel(), weights=p_u, minlength=len(ys)) / normalizer
+        return defaultdict(lambda: 0, {tuple(y): p_y for y, p_y in zip(ys.tolist(), prob_ys.tolist())})
+
+    def query_many(self, outcome: Tuple, interventions: Sequence[dict], condition: dict = None) -> np.ndarray:
+        """ P(outcome | condition, do(x)) for each intervention x as a row, columns ordered as product(*[D[Y] for Y in outcome]) """
+        condition = with_default(condition, dict())
+        outcome = tuple(outcome)
+        outcome_values = list(product(*[self.D[Y] for Y in outcome]))
+        probs = np.zeros((len(interventions), len(outcome_values)))
+        if self.backend in {'python', 'monte_carlo'}:
+            for i, intervention in enumerate(interventions):
+                result = self.query(outcome, condition, intervention)
+                probs[i] = [result[ys] for ys in outcome_values]
+            return probs
+
+        # ancestors in G include the ancestors under every intervention, so that all share one table
+        Vs = self.G.An(set(outcome) | set(condition))
+        U = self.relevant_U(Vs)
+        for i, p_u, assigned in self.evaluate_many(interventions, Vs, U, condition):
+            index = np.zeros(len(p_u), dtype=int)
+            for V_i in outcome:
+                index = index * len(self.D[V_i])
+                for k, y in enumerate(self.D[V_i]):
+                    index += k * (assigned[V_i] == y)
+            probs[i] = np.bincount(index, weights=p_u, minlength=len(outcome_values))
+        with np.errstate(invalid='ignore'):
+            return probs / np.sum(probs, axis=1, keepdims=True)  # nan for impossible conditions
+
+    def query_expectation(self, outcomes: Tuple, intervention: dict = None, condition: dict = None, per_outcome=False):
+        """ E[sum of outcomes | condition, do(intervention)], or E[Y | condition, do(intervention)] for each Y if per_outcome """
+        means = self.query_expectations(outcomes, [with_default(intervention, dict())], condition)[0]
+        if per_outcome:
+            return dict(zip(outcomes, means.tolist()))
+        return float(np.sum(means))
+
+    def query_expectations(self, outcomes: Tuple, interventions: Sequence[dict], condition: dict = None) -> np.ndarray:
+        """ E[Y | condition, do(x)] for each intervention x as a row and each Y in outcomes as a column, without any joint of outcomes """
+        condition = with_default(condition, dict())
+        outcomes = tuple(outcomes)
+        means = np.zeros((len(interventions), len(outcomes)))
+        if self.backend == 'python':
+            for i, intervention in enumerate(interventions):
+                for j, Y in enumerate(outcomes):
+                    result = self.query((Y,), condition, intervention)  # empty for an impossible condition
+                    means[i, j] = sum(y * p_y for (y,), p_y in result.items()) if result else np.nan
+            return means
+        if self.backend == 'monte_carlo':
+            for i, intervention in enumerate(interventions):
+                means[i] = self.query_expectation_monte_carlo(outcomes, intervention, condition, **self.monte_carlo)[0]
+            return means
+
+        # ancestors in G include the ancestors under every intervention, so that all share one table, and an
+        # intervention gets the same values alone as in any batch
+        Vs = self.G.An(set(outcomes) | set(condition))
+        U = self.relevant_U(Vs)
+        for i, p_u, assigned in self.evaluate_many(interventions, Vs, U, condition):
+            normalizer = np.sum(p_u)
+            means[i] = [np.dot(p_u, assigned[Y]) / normalizer if normalizer else np.nan for Y in outcomes]
+        return means
+
+    def query_monte_carlo(self, outcome: Tuple, condition: dict = None, intervention: dict = None, precision=1e-3,
+                          batch_size=4096, max_samples=10 ** 6, seed=0, min_samples=100) -> Tuple[defaultdict, Dict[Tuple, float]]:
+        """
+        Estimates of P(outcome | condition, do(intervention)) and their standard errors, from batches of exogenous samples
+        until at least min_samples agree with the condition and every standard error is at most precision, or max_samples
+        are drawn. Standard errors are of p shrunk to (count + 1) / (n + 2), which are not 0 for estimates of 0 or 1.
+        The samples are determined by the seed and the query, so that a query is answered the same way wherever it is asked.
+        """
+        condition = with_default(condition, dict())
+        intervention = with_default(intervention, dict())
+        outcome = tuple(outcome)
+        counts = defaultdict(int)
+        n = 0  # samples agreeing with the condition
+        for n_batch, assigned in self.sample_batches(outcome, condition, intervention, batch_size, max_samples, seed):
+            n += n_batch
+            if n_batch:
+                ys, ys_counts = np.unique(np.column_stack([assigned[V_i] for V_i in outcome] or [np.zeros(n_batch)]),
+                                          axis=0, return_counts=True)
+                for y, count in zip(ys.tolist(), ys_counts.tolist()):
+                    counts[tuple(y[:len(outcome)])] += count
+            if n >= min_samples and max(self._binomial_error(c, n) for c in counts.values()) <= precision:
+                break
+
+        if not n:
+            return defaultdict(lambda: np.nan), dict()  # nan or 0?
+        return (defaultdict(lambda: 0, {ys: c / n for ys, c in counts.items()}),
+                {ys: self._binomial_error(c, n) for ys, c in counts.items()})
+
+    def query_expectation_monte_carlo(self, outcomes: Tuple, intervention: dict = None, condition: dict = None, precision=1e-3,
+                                      batch_size=4096, max_samples=10 ** 6, seed=0, min_samples=100) -> Tuple[np.ndarray, float]:
+        """
+        Estimates of E[Y | condition, do(intervention)] for each Y in outcomes and the standard error of their sum, as
+        query_monte_carlo, where the standard error counts two more samples at the least and the largest sums
+        """
+        condition = with_default(condition, dict())
+        intervention = with_default(intervention, dict())
+        outcomes = tuple(outcomes)
+        lowest, highest = sum(min(self.D[Y]) for Y in outcomes), sum(max(self.D[Y]) for Y in outcomes)
+        sums, total_sq, n = np.zeros(len(outcomes)), lowest ** 2 + highest ** 2, 0
+        for n_batch, assigned in self.sample_batches(outcomes, condition, intervention, batch_size, max_samples, seed):
+            ys = np.zeros((n_batch, len(outcomes)))
+            for j, Y in enumerate(outcomes):
+                ys[:, j] = assigned[Y]
+            n += n_batch
+            sums += np.sum(ys, axis=0)
+            total_sq += float(np.sum(np.sum(ys, axis=1) ** 2))
+            if n >= min_samples and self._standard_error(np.sum(sums) + lowest + highest, total_sq, n + 2) <= precision:
+                break
+
+        if not n:
+            return np.full(len(outcomes), np.nan), np.nan
+        return sums / n, self._standard_error(np.sum(sums) + lowest + highest, total_sq, n + 2)
+
+    @staticmethod
+    def _binomial_error(count: int, n: int) -> float:
+        """ standard error of count / n with the estimate shrunk to (count + 1) / (n + 2) """
+        p = (count + 1) / (n + 2)
+        return float(np.sqrt(p * (1 - p) / n))
+
+    @staticmethod
+    def _standard_error(total: float, total_sq: float, n: int) -> float:
+        """ standard error of the mean given the sum and the sum of squares of n samples """
+        return float(np.sqrt(max(total_sq / n - (total / n) ** 2, 0.0) / max(n - 1, 1)))
+
+    def sample_batches(self, outcome: Tuple, condition: dict, intervention: dict, batch_size: int, max_samples: int,
+                       seed) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+        """ (number of samples agreeing with the condition, their values of U and the ancestors of the outcome and the condition) per batch """
+        Vs = self.G.do(set(intervention)).An(set(outcome) | set(condition))
+        U = self.relevant_U(Vs - set(intervention))
+        digest = hashlib.sha256(repr(self.query_key(outcome, condition, intervention)).encode()).hexdigest()
+        rng = np.random.default_rng([seed, int(digest[:16], 16)])
+        for start in range(0, max_samples, batch_size):
+            n = min(batch_size, max_samples - start)
+            assigned = {k: np.broadcast_to(col, (n,)) for k, col in self.evaluate(self.sample_exogenous(n, U, rng), intervention, Vs).items()}
+            agree = np.ones(n, dtype=bool)
+            for V_i, value in condition.items():
+                agree &= assigned[V_i] == value
+            yield int(np.sum(agree)), {k: col[agree] for k, col in assigned.items()}
+
+    def U_pa(self, V_i: str) -> FrozenSet[str]:
+        """ exogenous variables read by F[V_i], its parents if declared (e.g., StructuralFunction), or recorded from a call on a single row """
+        if V_i not in self._U_pa:
+            all_U = self.G.U | self.more_U
+            parents = getattr(self.F[V_i], 'parents', None)
+            if parents is None:
+                probe = KeyRecorder({k: np.asarray(self.D[k][:1]) for k in all_U | self.G.V})
+                self.F[V_i](probe)
+                parents = probe.keys_read
+            self._U_pa[V_i] = frozenset(parents & all_U)
+        return self._U_pa[V_i]
+
+    def relevant_U(self, Vs: AbstractSet[str]) -> FrozenSet[str]:
+        """ U read by Vs (or U in Vs), or all U if P(U) is not known to factorize so that the others cannot be summed out """
+        if not isinstance(self.P_U, ProductP_U):
+            return frozenset(self.G.U | self.more_U)
+        # U among Vs (e.g., conditioned on) are read by themselves
+        return fzset_union({V_i} if V_i in self.G.U | self.more_U else self.U_pa(V_i) for V_i in Vs)
+
+    def exogenous_columns(self, U: AbstractSet[str] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """ P(U) and U as columns over all assignments of U (all exogenous variables by default) with non-zero probability """
+        U = sortup(with_default(U, self.G.U | self.more_U))
+        if U not in self._exogenous_columns:
+            if isinstance(self.P_U, ProductP_U):
+                # zero-probability values are never enumerated
+                U_columns = product_columns({U_i: self.P_U.support(U_i, self.D[U_i]) for U_i in U}, U)
+                p_u = self.P_U.prob(U_columns)
+            else:
+                U_columns = product_columns(self.D, U)
+                p_u = self.P_U_columns(U_columns, int(np.prod([len(self.D[U_i]) for U_i in U])))
+            nonzero = p_u != 0
+            self._exogenous_columns[U] = p_u[nonzero], {U_i: col[nonzero] for U_i, col in U_columns.items()}
+        return self._exogenous_columns[U]
+
+    def sample(self, n: int, intervention: dict = None, rng: np.random.Generator = None) -> Dict[str, np.ndarray]:
+        """ n samples of all U and V under the intervention as columns, drawn and evaluated at once """
+        U_columns = self.sample_exogenous(n, rng=rng)
+        return {k: np.broadcast_to(col, (n,)) for k, col in self.evaluate(U_columns, with_default(intervention, dict())).items()}
+
+    def sample_exogenous(self, n: int, U: AbstractSet[str] = None, rng: np.random.Generator = None) -> Dict[str, np.ndarray]:
+        """ n independent draws of U (all exogenous variables by default) from P(U) as columns, where P(U) must be a ProductP_U """
+        if not isinstance(self.P_U, ProductP_U):
+            # drawing from all d^|U| assignments would cost more than exact inference
+            raise AssertionError(f'sampling requires P(U) factorized as a ProductP_U, not {type(self.P_U).__name__}')
+        U = sortup(with_default(U, self.G.U | self.more_U))
+        return self.P_U.sample(U, n, with_default(rng, np.random.default_rng()), self.D)
+
+    def evaluate_columns(self, intervention: dict, Vs: AbstractSet[str] = None, U: AbstractSet[str] = None,
+                         condition: dict = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """
+        P(U) and values of U and Vs (all V by default) under the intervention for the rows of exogenous_columns(U)
+        which agree with the condition, where rows are discarded as soon as a conditioned variable disagrees
+        """
+        p_u, U_columns = self.exogenous_columns(U)
+        if not condition:
+            return p_u, self.evaluate(U_columns, intervention, Vs)
+
+        assigned = dict(U_columns)
+        # rows disagreeing with conditioned U are discarded before any evaluation
+        conditioned_U = sortup(condition.keys() & U_columns.keys())
+        if conditioned_U:
+            agree = np.logical_and.reduce([U_columns[U_i] == condition[U_i] for U_i in conditioned_U])
+            p_u = p_u[agree]
+            assigned = {k: col[agree] for k, col in assigned.items()}
+        n = len(p_u)
+        for V_i in self.evaluation_order(intervention, with_default(Vs, self.G.V), condition):
+            if V_i in intervention:
+                assigned[V_i] = np.full(n, intervention[V_i])
+            else:
+                assigned[V_i] = np.broadcast_to(self.F[V_i](assigned), (n,))  # pa_i including unobserved
+            if V_i in condition:
+                agree = assigned[V_i] == condition[V_i]
+                if not np.all(agree):
+                    p_u = p_u[agree]
+                    assigned = {k: col[agree] for k, col in assigned.items()}
+                    n = len(p_u)
+        return p_u, assigned
+
+    def evaluate_many(self, interventions: Sequence[dict], Vs: AbstractSet[str] = None, U: AbstractSet[str] = None,
+                      condition: dict = None) -> Iterator[Tuple[int, np.ndarray, Dict[str, np.ndarray]]]:
+        """ (i, P(U), values) as evaluate_columns for the i-th intervention, in no particular order of i """
+        if condition or len(interventions) == 1:
+            for i, intervention in enumerate(interventions):
+                yield (i, *self.evaluate_columns(intervention, Vs, U, condition))
+        else:
+            p_u, U_columns = self.exogenous_columns(U)
+            for i, assigned in self.evaluate_trie(U_columns, interventions, Vs):
+                yield i, p_u, assigned
+
+    def evaluate_trie(self, U_columns: Dict[str, np.ndarray], interventions: Sequence[dict],
+                      Vs: AbstractSet[str] = None) -> Iterator[Tuple[int, Dict[str, np.ndarray]]]:
+        """
+        (i, values) as evaluate for the i-th intervention, in no particular order of i. Starting from the observational
+        values, each intervention recomputes only the descendants of its intervened variables, and interventions sharing
+        a prefix in causal order share the values computed for the prefix, i.e., a depth-first traversal of their trie.
+        Vs must include their ancestors in G (not only in G under the interventions) for the observational values.
+        """
+        Vs = with_default(Vs, self.G.V)
+        position = {V_i: k for k, V_i in enumerate(self.G.causal_order())}
+        n = len(next(iter(U_columns.values()))) if U_columns else 1
+        # interventions on variables other than Vs do not change Vs
+        keys = [tuple(sorted(((x, v) for x, v in intervention.items() if x in Vs), key=lambda xv: position[xv[0]]))
+                for intervention in interventions]
+
+        stack = [((), self.evaluate(U_columns, dict(), Vs))]  # a path of the trie from the root (no intervention)
+        for i in sorted(range(len(keys)), key=lambda j: [(position[x], v) for x, v in keys[j]]):
+            key = keys[i]
+            while key[:len(stack[-1][0])] != stack[-1][0]:
+                stack.pop()
+            for x, v in key[len(stack[-1][0]):]:
+                prefix, parent = stack[-1]
+                assigned = dict(parent)
+                assigned[x] = np.full(n, v)
+                intervened = {x_j for x_j, _ in prefix}
+                for V_i in sorted(self.G.de(x) & Vs - intervened, key=position.get):
+                    assigned[V_i] = np.broadcast_to(self.F[V_i](assigned), (n,))  # pa_i including unobserved
+                stack.append(((*prefix, (x, v)), assigned))
+            yield i, stack[-1][1]
+
+    def evaluation_order(self, intervention: dict, Vs: AbstractSet[str], condition: dict) -> Tuple[str, ...]:
+        """ Vs in a causal order where the ancestors of each conditioned variable come as early as possible """
+        G = self.G.do(set(intervention))
+        order = dict()
+        for C in (V_i for V_i in self.G.causal_order() if V_i in condition):
+            order.update((V_i, None) for V_i in self.G.causal_order() if V_i in G.An(C) and V_i in Vs)
+        order.update((V_i, None) for V_i in self.G.causal_order() if V_i in Vs)
+        return tuple(order)
+
+    def evaluate(self, U_columns: Dict[str, np.ndarray], intervention: dict, Vs: AbstractSet[str] = None) -> Dict[str, np.ndarray]:
+        """ values of U and Vs (all V by default) under the intervention for every row of the given U columns """
+        n = len(next(iter(U_columns.values()))) if U_columns else 1
+        assigned = dict(U_columns)
+        for V_i in self.G.causal_order():
+            if Vs is not None and V_i not in Vs:
+                continue
+            if V_i in intervention:
+                assigned[V_i] = np.full(n, intervention[V_i])
+            else:
+                assigned[V_i] = np.broadcast_to(self.F[V_i](assigned), (n,))  # pa_i including unobserved
+        return assigned
+
+    def response_table(self, outcome: Tuple, interventions: Sequence[dict]) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+        """ Full domains of U relevant to the outcome as columns, and the outcome under each intervention for every row
+        as an (interventions x rows x |outcome|) array. Since F is deterministic, neither depends on the parameters of P(U). """
+        Vs = self.G.An(set(outcome))
+        U = sortup(self.relevant_U(Vs))
+        U_columns = product_columns(self.D, U)
+        n = int(np.prod([len(self.D[U_i]) for U_i in U]))
+        dtype = np.result_type(*[np.min_scalar_type(y) for Y in outcome for y in self.D[Y]])
+        responses = np.zeros((len(interventions), n, len(outcome)), dtype=dtype)
+        for i, assigned in self.evaluate_trie(U_columns, interventions, Vs):
+            for j, Y in enumerate(outcome):
+                responses[i, :, j] = assigned[Y]
+        return U_columns, responses
+
+    def P_U_columns(self, assigned: Dict[str, np.ndarray], n: int) -> np.ndarray:
+        """ P(U) of every row, falling back to one call per row if P_U does not work on columns """
+        if isinstance(self.P_U, ProductP_U):
+            return self.P_U.prob(assigned)
+        try:
+            p_u = np.asarray(self.P_U(assigned), dtype=float)
+        except (TypeError, ValueError):
+            p_u = None
+        if p_u is None or p_u.shape != (n,):
+            p_u = np.array([self.P_U({k: col[i] for k, col in assigned.items()}) for i in range(n)], dtype=float)
+        return p_u
+
+    def _domain(self, V_i) -> Optional[Tuple]:
+        """ D[V_i] as a tuple, or None if not given (e.g., for variables that are always intervened) """
+        try:
+            return tuple(self.D[V_i])
+        except KeyError:
+            return None
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        Digest of the diagram, domains, P(U) and F, identical for models built the same way in any process,
+        or None if P(U) or F hold values without a stable representation (see value_fingerprint)
+        """
+        all_U = sortup(self.G.U | self.more_U)
+        try:
+            if isinstance(self.P_U, ProductP_U):
+                P_U = sortup((U_i, sortup(factor.items())) for U_i, factor in self.P_U.factors.items())
+            else:
+                P_U = code_fingerprint(self.P_U)
+            F = tuple((V_i, code_fingerprint(self.F.get(V_i))) for V_i in sortup(self.G.V))  # None if always intervened
+        except ValueError:
+            return None
+        content = (sortup(self.G.V), sortup(self.G.edges), sortup(self.G.confounded_to_3tuples()), all_U,
+                   tuple((k, self._domain(k)) for k in sortup(self.G.V | set(all_U))),
+                   P_U, F)
+        return hashlib.sha256(repr(content).encode()).hexdigest()
+
 
 def quick_causal_diagram(paths, bidirectedpaths=None):
     if bidirectedpaths is None:
@@ -1,10 +1,18 @@
-from itertools import product
+import hashlib
+import os
+import tempfile
+from bisect import bisect_right
+from itertools import product, accumulate
 from collections import defaultdict
+from collections.abc import Mapping
 from typing import Dict, Tuple, Union, Any
 
-from npsem.model import StructuralCausalModel
-from npsem.utils import combinations
-from npsem.where_do import POMISs
+import numpy as np
+from joblib import Parallel, delayed, cpu_count
+
+from npsem.model import StructuralCausalModel, ProductP_U, BernoulliP_U
+from npsem.utils import combinations, mkdirs, sortup, with_default
+from npsem.where_do import POMISs, minimal_do
 from npsem.pomis_plus import POMISplusSEQ
 
 
@@ -18,33 +26,245 @@ def group_by_time_index(G_V):
                 break
     return [grouped[i] for i in sorted(grouped.keys())]
 
-def SCM_to_bandit_machine(M: StructuralCausalModel, Ys: set()) -> Tuple[Tuple, Dict[Union[int, Any], Dict]]:
-    """
-    Returns all intervention combinations for standard arms (e.g., {'0': {}, '1': {'S': 0, 'T': 1}, ...})
-    and their true expected rewards (mu)
-    """
-    G = M.G
-    mu_arm = list()
+def all_arm_settings(M: StructuralCausalModel, Ys) -> Dict[int, Dict]:
+    """ All intervention combinations on G.V - Ys by arm id, e.g., {0: {}, 1: {'S': 0}, ..., 9: {'S': 0, 'T': 1}, ...} """
     arm_setting = dict()
     arm_id = 0
-    all_subsets = list(combinations(sorted(G.V - Ys)))
+    all_subsets = list(combinations(sorted(M.G.V - set(Ys))))
     for _, subset in enumerate(all_subsets):
 
         # Cartesian product of variable domains, e.g., X0: D(0,1), Z0: D(0,1) → (0,0), (0,1), (1,0), (1,1)
         for values in product(*[M.D[variable] for variable in subset]):
-
             arm_setting[arm_id] = dict(zip(subset, values))
+            arm_id += 1
+    return arm_setting
 
-            Ys = tuple(Ys)
-            result = M.query(Ys, intervention=arm_setting[arm_id])
 
-            expectation = 0
-            for y_values, p_ys in result.items():
-                expectation += sum(y_values) * p_ys
-            mu_arm.append(expectation)
-            arm_id += 1
+def expected_rewards(M: StructuralCausalModel, Ys, interventions, monte_carlo: dict = None) -> np.ndarray:
+    """
+    E[sum of Ys | do(x)] for each intervention x, computed row by row so that an arm gets the same value in any batch.
+    Given monte_carlo, keyword arguments of StructuralCausalModel.query_expectation_monte_carlo, they are estimated instead.
+    """
+    if monte_carlo is not None:
+        return np.array([np.sum(M.query_expectation_monte_carlo(sortup(Ys), x, **monte_carlo)[0]) for x in interventions])
+    # one evaluation of P(U) shared by all arms, and E[Y_t]'s by linearity rather than the joint over Ys
+    return np.sum(M.query_expectations(sortup(Ys), interventions), axis=1)
+
+
+def minimal_interventions(G, Ys, arm_setting, arm_ids=None, minimal=None) -> Dict[int, Tuple]:
+    """ arm id to its intervention restricted by minimal_do to Xs & G.do(Xs).An(Ys), as sorted (variable, value) pairs """
+    minimal = dict() if minimal is None else minimal  # intervened variables to their minimal_do
+    Ys = frozenset(Ys)
+    reduced = dict()
+    for arm_x in (range(len(arm_setting)) if arm_ids is None else arm_ids):
+        setting = arm_setting[arm_x]
+        Xs = frozenset(setting)
+        if Xs not in minimal:
+            minimal[Xs] = minimal_do(G, Ys, Xs)
+        reduced[arm_x] = sortup((variable, setting[variable]) for variable in minimal[Xs])
+    return reduced
+
+
+def arm_equivalence_classes(G, Ys, arm_setting) -> Dict[int, int]:
+    """ arm id to the smallest arm id with the same minimal intervention, hence the same expected reward """
+    representative = dict()
+    return {arm_x: representative.setdefault(reduced, arm_x)
+            for arm_x, reduced in minimal_interventions(G, Ys, arm_setting).items()}
+
+
+def SCM_to_bandit_machine(M: StructuralCausalModel, Ys: set(), n_jobs=1, model_factory=None, monte_carlo: dict = None) -> Tuple[Tuple, Dict[Union[int, Any], Dict]]:
+    """
+    Returns all intervention combinations for standard arms (e.g., {'0': {}, '1': {'S': 0, 'T': 1}, ...})
+    and their true expected rewards (mu)
+
+    Arms with the same minimal intervention (see arm_equivalence_classes) share a reward computed once.
+    With n_jobs other than 1, the rewards of those minimal interventions are computed by worker processes,
+    which rebuild the model with model_factory (e.g., functools.partial(X0toY2, True, seed=0)) since models cannot be pickled,
+    or with the factory of the model if loaded from a specification (see scm_spec).
+    Given monte_carlo (e.g., {'precision': 1e-3}), rewards are estimated by sampling as in expected_rewards.
+    """
+    arm_setting = all_arm_settings(M, Ys)
+    reduced = minimal_interventions(M.G, Ys, arm_setting)
+    classes = list(dict.fromkeys(reduced.values()))
+    interventions = [dict(pairs) for pairs in classes]
+    n_jobs = with_default(n_jobs, 1)
+    if n_jobs == 1:
+        class_mu = expected_rewards(M, Ys, interventions, monte_carlo).tolist()
+    else:
+        model_factory = with_default(model_factory, getattr(M, 'factory', None))  # e.g., models of scm_spec.load_scm
+        assert model_factory is not None, 'model_factory is required to rebuild the model in worker processes'
+        n_jobs = n_jobs if n_jobs > 0 else cpu_count() + 1 + n_jobs
+        bounds = np.linspace(0, len(interventions), min(n_jobs, len(interventions)) + 1).astype(int).tolist()
+        fingerprint = M.fingerprint()
+        parts = Parallel(n_jobs=n_jobs)(delayed(bandit_machine_part)(model_factory, tuple(Ys), interventions[start:stop], monte_carlo,
+                                                                     fingerprint)
+                                        for start, stop in zip(bounds, bounds[1:]))
+        class_mu = [mu for part in parts for mu in part]
+
+    class_mu = dict(zip(classes, class_mu))
+    return tuple(class_mu[reduced[arm_x]] for arm_x in range(len(arm_setting))), arm_setting
+
+
+def bandit_machine_part(model_factory, Ys, interventions, monte_carlo: dict = None, fingerprint: str = None) -> list:
+    """ expected rewards of the interventions in the model built by model_factory, which must have the given fingerprint if any """
+    M = model_factory()
+    if isinstance(M, tuple):  # e.g., (M, mu1) of scm_examples
+        M = M[0]
+    assert fingerprint is None or M.fingerprint() == fingerprint, 'model_factory builds a model other than the given one'
+    return expected_rewards(M, Ys, interventions, monte_carlo).tolist()
+
+
+class ArmSettings(Mapping):
+    """ all_arm_settings as an index space, where the intervention of an arm id is computed when asked for """
+
+    def __init__(self, M: StructuralCausalModel, Ys):
+        self.subsets = list(combinations(sorted(M.G.V - set(Ys))))
+        self.domains = [tuple(M.D[variable] for variable in subset) for subset in self.subsets]
+        self.offsets = [0, *accumulate(int(np.prod([len(domain) for domain in domains])) for domains in self.domains)]
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __iter__(self):
+        return iter(range(len(self)))
+
+    def __getitem__(self, arm_id) -> Dict:
+        if not 0 <= arm_id < len(self):
+            raise KeyError(arm_id)
+        i = bisect_right(self.offsets, arm_id) - 1
+        index = np.unravel_index(arm_id - self.offsets[i], [len(domain) for domain in self.domains[i]])
+        return {variable: domain[k] for variable, domain, k in zip(self.subsets[i], self.domains[i], index)}
+
+    def arms_of(self, subsets) -> Tuple[int, ...]:
+        """ ids of all arms intervening on exactly one of the given sets of variables """
+        subsets = {frozenset(subset) for subset in subsets}
+        return tuple(arm_x for i, subset in enumerate(self.subsets) if frozenset(subset) in subsets
+                     for arm_x in range(self.offsets[i], self.offsets[i + 1]))
+
+
+class LazyBanditMachine:
+    """ SCM_to_bandit_machine which computes expected rewards only for the arms asked for, and remembers them """
+
+    def __init__(self, M: StructuralCausalModel, Ys: set(), chunk_size=4096):
+        self.M = M
+        self.Ys = tuple(Ys)
+        self.arm_setting = ArmSettings(M, Ys)
+        self.chunk_size = chunk_size
+        self._mu = dict()
+        self._class_mu = dict()  # minimal intervention to its expected reward
+        self._minimal = dict()  # intervened variables to their minimal_do
+        self._optimum = None
+
+    def __len__(self):
+        return len(self.arm_setting)
+
+    def _rewards(self, classes):
+        missing = [reduced for reduced in dict.fromkeys(classes) if reduced not in self._class_mu]
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start:start + self.chunk_size]
+            self._class_mu.update(zip(chunk, expected_rewards(self.M, self.Ys, [dict(pairs) for pairs in chunk]).tolist()))
+
+    def mu(self, arm_ids) -> Tuple:
+        """ expected rewards of the given arms, computed once per minimal intervention """
+        reduced = minimal_interventions(self.M.G, self.Ys, self.arm_setting, dict.fromkeys(arm_ids), self._minimal)
+        self._rewards(reduced.values())
+        self._mu.update((arm_x, self._class_mu[pairs]) for arm_x, pairs in reduced.items())
+        return tuple(self._mu[arm_x] for arm_x in arm_ids)
+
+    def optimum(self) -> Tuple[int, float]:
+        """ (arm id, expected reward) of the best arm, scanning one arm per minimal intervention in chunks """
+        if self._optimum is None:
+            # an arm whose intervention is already minimal has the smallest id in its class
+            Ys = frozenset(self.Ys)
+            subsets = [subset for subset in self.arm_setting.subsets if minimal_do(self.M.G, Ys, frozenset(subset)) == frozenset(subset)]
+            arms = self.arm_setting.arms_of(subsets)
+            best_arm, best_mu = None, -np.inf
+            for start in range(0, len(arms), self.chunk_size):
+                chunk = arms[start:start + self.chunk_size]
+                means = expected_rewards(self.M, self.Ys, [self.arm_setting[arm_x] for arm_x in chunk])
+                i = int(np.argmax(means))
+                if means[i] > best_mu:
+                    best_arm, best_mu = chunk[i], float(means[i])
+            self._mu.setdefault(best_arm, best_mu)
+            self._class_mu.setdefault(sortup(self.arm_setting[best_arm].items()), best_mu)
+            self._optimum = best_arm, self._mu[best_arm]
+        return self._optimum
+
+    def dense_mu(self) -> np.ndarray:
+        """ expected rewards of all arms by arm id, nan for those not computed """
+        mu = np.full(len(self), np.nan)
+        mu[list(self._mu)] = list(self._mu.values())
+        return mu
+
+
+class ResponseTable:
+    """
+    Rewards of every arm for every assignment of U, which do not depend on the parameters of P(U), so that
+    the expected rewards under another parametrization (e.g., mu1 of scm_examples) are a matrix-vector product
+    """
+
+    def __init__(self, M: StructuralCausalModel, Ys: set(), chunk_size=4096):
+        self.arm_setting = all_arm_settings(M, Ys)
+        self.U_columns, responses = M.response_table(tuple(Ys), [self.arm_setting[arm_x] for arm_x in range(len(self.arm_setting))])
+        lo, hi = np.min(responses, initial=0) * responses.shape[2], np.max(responses, initial=0) * responses.shape[2]
+        self.rewards = np.sum(responses, axis=2, dtype=np.result_type(np.min_scalar_type(lo), np.min_scalar_type(hi)))
+        self.chunk_size = chunk_size
+
+    def mu_arm(self, P_U: Union[Dict, ProductP_U]) -> Tuple:
+        """ expected rewards of all arms given P(U) or a dictionary of P(U_i=1) """
+        if not isinstance(P_U, ProductP_U):
+            P_U = BernoulliP_U(P_U)
+        p_u = P_U.prob(self.U_columns)
+        p_u = p_u / np.sum(p_u)
+        # chunks of arms bound the memory of the rewards cast to float
+        return tuple(np.concatenate([self.rewards[i:i + self.chunk_size] @ p_u
+                                     for i in range(0, len(self.rewards), self.chunk_size)]).tolist())
+
+    def bandit_machine(self, P_U: Union[Dict, ProductP_U]) -> Tuple[Tuple, Dict[Union[int, Any], Dict]]:
+        """ the same as SCM_to_bandit_machine for the model with P(U) replaced """
+        return self.mu_arm(P_U), self.arm_setting
+
+class SCMEnvironment:
+    """
+    Arms pulled from the model itself rather than from known expected rewards, with a reward Bernoulli(sum of Ys / scale)
+    as rands[t] <= mu[arm] / 3 of the bandit algorithms. Pulls of an arm are served from a block of samples drawn at once.
+    """
+
+    def __init__(self, M: StructuralCausalModel, Ys, interventions, block_size=4096, seed=None, scale=3):
+        self.M = M
+        self.Ys = sortup(Ys)
+        self.interventions = list(interventions)
+        self.block_size = block_size
+        self.scale = scale
+        self.rng = np.random.default_rng(seed)
+        self._blocks = [np.zeros(0, dtype=np.int8)] * len(self.interventions)
+        self._positions = [0] * len(self.interventions)
+
+    @classmethod
+    def of(cls, model_factory, Ys, interventions, seed=None, **kwargs) -> 'SCMEnvironment':
+        """ environment of the model built by model_factory, e.g., in a worker process since models cannot be pickled """
+        M = model_factory()
+        if isinstance(M, tuple):  # e.g., (M, mu1) of scm_examples
+            M = M[0]
+        return cls(M, Ys, interventions, seed=seed, **kwargs)
+
+    def __len__(self):
+        return len(self.interventions)
+
+    def pull(self, arm: int) -> int:
+        """ reward of pulling the arm """
+        if self._positions[arm] == len(self._blocks[arm]):
+            self._blocks[arm] = self.draw(arm, self.block_size)
+            self._positions[arm] = 0
+        self._positions[arm] += 1
+        return int(self._blocks[arm][self._positions[arm] - 1])
+
+    def draw(self, arm: int, n: int) -> np.ndarray:
+        """ n fresh rewards of the arm """
+        assigned = self.M.sample(n, self.interventions[arm], self.rng)
+        total = np.sum([assigned[Y] for Y in self.Ys], axis=0)
+        return (self.rng.random(n) * self.scale < total).astype(np.int8)
 
-    return tuple(mu_arm), arm_setting
 
 def ns_arm_types():
     return ['POMIS', 'POMIS+']
@@ -58,6 +278,12 @@ def ns_arms_of(arm_type: str, arm_setting, G, Ys) -> Tuple[int, ...]:
         return tuple(range(len(arm_setting)))
     raise AssertionError(f'unknown: {arm_type}')
 
+def arms_intervening_on(arm_setting, subsets) -> Tuple[int, ...]:
+    if isinstance(arm_setting, ArmSettings):
+        return arm_setting.arms_of(subsets)
+    return tuple(arm_x for arm_x in range(len(arm_setting)) if set(arm_setting[arm_x]) in subsets)
+
+
 def pomis_plus_arms_of(arm_setting, G, Ys):
     Vs = group_by_time_index(G.V)
 
@@ -68,7 +294,7 @@ def pomis_plus_arms_of(arm_setting, G, Ys):
     re = POMISplusSEQ(G=G, Vs=Vs, Ys=list(Ys), T=len(Ys) - 1)
     pomis_pluss = {frozenset().union(*tup) for tup in re}
 
-    return tuple(arm_x for arm_x in range(len(arm_setting)) if set(arm_setting[arm_x]) in pomis_pluss)
+    return arms_intervening_on(arm_setting, pomis_pluss)
 
 
 def pomis_arms_of(arm_setting, G, Ys):
@@ -80,4 +306,60 @@ def pomis_arms_of(arm_setting, G, Ys):
     # calculate each pomis for each time (Myopic)
     pomiss_myoptic = {frozenset().union(*combo) for combo in product(*[pomiss_ts[t] for t in sorted(pomiss_ts)])}
 
-    return tuple(arm_x for arm_x in range(len(arm_setting)) if set(arm_setting[arm_x]) in pomiss_myoptic)
\ No newline at end of file
+    return arms_intervening_on(arm_setting, pomiss_myoptic)
+
+def bandit_artifacts(M: StructuralCausalModel, Ys, arm_types, directory=None) -> Tuple[np.ndarray, Mapping, Dict[str, Tuple[int, ...]]]:
+    """
+    Returns mu (nan except the arms of the given arm types and the optimal arm), arm_setting, and the arms of each arm type.
+    They are deterministic in the model and Ys, hence loaded from the directory if saved for the same fingerprint before,
+    where models without a fingerprint (see StructuralCausalModel.fingerprint) are never saved nor loaded.
+    """
+    path = None
+    fingerprint = M.fingerprint() if directory is not None else None
+    if fingerprint is not None:
+        key = hashlib.sha256(repr((fingerprint, sortup(Ys), sortup(arm_types))).encode()).hexdigest()
+        path = os.path.join(directory, key + '.npz')
+        if os.path.exists(path):
+            return load_bandit_artifacts(path)
+
+    machine = LazyBanditMachine(M, Ys)
+    arms_of = {arm_type: ns_arms_of(arm_type, machine.arm_setting, M.G, Ys) for arm_type in arm_types}
+    for arm_selected in arms_of.values():
+        machine.mu(arm_selected)
+    machine.optimum()
+    mu = machine.dense_mu()
+
+    if path is not None:
+        save_bandit_artifacts(path, mu, machine.arm_setting, arms_of)
+    return mu, machine.arm_setting, arms_of
+
+
+def save_bandit_artifacts(path, mu, arm_setting, arms_of):
+    """ arm_setting as matrices of values and of whether each variable is intervened, without pickling """
+    variables = sortup({variable for arm_x in range(len(arm_setting)) for variable in arm_setting[arm_x]})
+    values = np.zeros((len(arm_setting), len(variables)), dtype=int)
+    intervened = np.zeros((len(arm_setting), len(variables)), dtype=bool)
+    for arm_x in range(len(arm_setting)):
+        for j, variable in enumerate(variables):
+            if variable in arm_setting[arm_x]:
+                values[arm_x, j] = arm_setting[arm_x][variable]
+                intervened[arm_x, j] = True
+    arm_types = list(arms_of)
+    arrays = {f'arms_{i}': np.array(arms_of[arm_type], dtype=int) for i, arm_type in enumerate(arm_types)}
+
+    directory = os.path.dirname(path)
+    mkdirs(directory)
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.npz', delete=False) as f:
+        np.savez_compressed(f, mu=mu, variables=np.array(variables, dtype=str), values=values, intervened=intervened,
+                            arm_types=np.array(arm_types, dtype=str), **arrays)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)  # never leave a partial file at path
+
+
+def load_bandit_artifacts(path) -> Tuple[np.ndarray, Dict[int, Dict], Dict[str, Tuple[int, ...]]]:
+    with np.load(path, allow_pickle=False) as loaded:
+        variables = loaded['variables'].tolist()
+        arm_setting = {arm_x: {variable: value for variable, value, on in zip(variables, values, intervened) if on}
+                       for arm_x, (values, intervened) in enumerate(zip(loaded['values'].tolist(), loaded['intervened'].tolist()))}
+        arms_of = {arm_type: tuple(loaded[f'arms_{i}'].tolist()) for i, arm_type in enumerate(loaded['arm_types'].tolist())}
+        return loaded['mu'], arm_setting, arms_of
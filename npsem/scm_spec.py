@@ -0,0 +1,140 @@
+import functools
+from collections import defaultdict
+from typing import Dict, FrozenSet
+
+import numpy as np
+
+from npsem.model import CausalDiagram, StructuralCausalModel, ProductP_U, default_P_U
+from npsem.utils import sortup
+
+# operators of expressions and their infix forms on arrays of 0/1 values
+OPERATORS = {'xor': ' ^ ', 'and': ' & ', 'or': ' | '}
+
+
+def normalize(expr):
+    """ expression with lists (e.g., from JSON) turned into tuples """
+    if isinstance(expr, (list, tuple)):
+        return tuple(normalize(e) for e in expr)
+    return expr
+
+
+def parents_of(expr) -> FrozenSet[str]:
+    """ variables read by an expression """
+    if isinstance(expr, str):
+        return frozenset({expr})
+    if isinstance(expr, tuple):
+        if expr[0] == 'table':
+            return frozenset(expr[1])
+        return frozenset().union(*[parents_of(e) for e in expr[1:]])
+    return frozenset()
+
+
+def lookup(table: np.ndarray, *values):
+    """ entry of the table indexed by values, or entries of columns of values """
+    output = table[values]
+    return output.item() if np.ndim(output) == 0 else output
+
+
+class StructuralFunction:
+    """
+    F[V_i] given as an expression, which is a variable name, an integer, or ('xor' | 'and' | 'or', expr, ...), ('not', expr),
+    or ('table', (variable, ...), ((value, ..., output), ...)), e.g., ('xor', 'U_X0', ('not', 'W0')).
+    The expression is compiled to one vectorized function of v, which works on columns as well as on single values.
+    Only the expression is pickled, and it determines the fingerprint of the function.
+    """
+
+    def __init__(self, expr):
+        self.expr = normalize(expr)
+        self.parents = parents_of(self.expr)
+        self._tables = list()
+        self._f = eval(f'lambda v: {self._compile(self.expr)}', {'_tables': self._tables, '_lookup': lookup})
+
+    def _compile(self, expr) -> str:
+        if isinstance(expr, str):
+            return f'v[{expr!r}]'
+        if isinstance(expr, (int, np.integer)):
+            return repr(int(expr))
+        if not isinstance(expr, tuple) or not expr:
+            raise AssertionError(f'unknown expression: {expr!r}')
+        op, args = expr[0], expr[1:]
+        if op in OPERATORS:
+            return '(' + OPERATORS[op].join(self._compile(arg) for arg in args) + ')'
+        if op == 'not':
+            return f'(1 - {self._compile(args[0])})'
+        if op == 'table':
+            variables, rows = args
+            table = np.zeros([max(row[k] for row in rows) + 1 for k in range(len(variables))], dtype=int)
+            for *values, output in rows:
+                table[tuple(values)] = output
+            self._tables.append(table)
+            return f'_lookup(_tables[{len(self._tables) - 1}], ' + ', '.join(f'v[{x!r}]' for x in variables) + ')'
+        raise AssertionError(f'unknown operator: {op}')
+
+    def __call__(self, v):
+        return self._f(v)
+
+    def __repr__(self):
+        return f'StructuralFunction({self.expr!r})'
+
+    def __eq__(self, other):
+        return isinstance(other, StructuralFunction) and self.expr == other.expr
+
+    def __hash__(self):
+        return hash(self.expr)
+
+    def __reduce__(self):
+        return StructuralFunction, (self.expr,)
+
+
+class SpecModel(StructuralCausalModel):
+    """ StructuralCausalModel loaded from a specification, which is pickled as the specification and rebuilt from it """
+
+    def __init__(self, spec: Dict, **kwargs):
+        self.spec = spec
+        self.options = kwargs
+        G = CausalDiagram(spec['V'], [tuple(edge) for edge in spec.get('edges', ())],
+                          [tuple(u) for u in spec.get('confounded', ())])
+        D = defaultdict(lambda: (0, 1), {k: tuple(domain) for k, domain in spec.get('D', dict()).items()})
+        F = {V_i: StructuralFunction(expr) for V_i, expr in spec['F'].items()}
+        super().__init__(G, F=F, P_U=spec_P_U(spec['P_U']), D=D, more_U=spec.get('more_U'), **kwargs)
+
+    def __reduce__(self):
+        return self.factory, ()
+
+    @property
+    def factory(self):
+        """ function to rebuild the model, e.g., in worker processes """
+        return functools.partial(load_scm, self.spec, **self.options)
+
+
+def spec_P_U(P_U: Dict) -> ProductP_U:
+    """ P(U) given each U_i as P(U_i=1) or as a categorical distribution {u_i: P(U_i=u_i)} """
+    if all(isinstance(mu_i, (int, float)) for mu_i in P_U.values()):
+        return default_P_U(P_U)
+    return ProductP_U({U_i: {0: 1 - p, 1: p} if isinstance(p, (int, float)) else p for U_i, p in P_U.items()})
+
+
+def load_scm(spec: Dict, **kwargs) -> SpecModel:
+    """
+    StructuralCausalModel of a specification, a dictionary (e.g., from JSON) with
+    'V': variables, 'edges': directed edges, 'confounded': (V_i, V_j, U) for bidirected edges,
+    'F': {V_i: expression of StructuralFunction}, 'P_U': {U_i: P(U_i=1) or {u_i: P(U_i=u_i)}},
+    and optionally 'D': {variable: domain} (binary by default) and 'more_U': exogenous variables not in 'confounded'.
+    kwargs are passed to StructuralCausalModel, e.g., backend='numpy'.
+    """
+    return SpecModel(spec, **kwargs)
+
+
+def spec_of(V, edges, confounded, F, P_U, D=None, more_U=None) -> Dict:
+    """ specification with its parts in canonical order """
+    spec = {'V': sortup(V),
+            'edges': sortup(tuple(edge) for edge in edges),
+            'confounded': sortup(tuple(u) for u in confounded),
+            'F': {V_i: normalize(F[V_i]) for V_i in sortup(F)},
+            'P_U': {U_i: P_U[U_i] for U_i in sortup(P_U)}}
+    if D:
+        spec['D'] = {k: tuple(D[k]) for k in sortup(D)}
+    if more_U:
+        spec['more_U'] = sortup(more_U)
+    return spec
+
@@ -0,0 +1,109 @@
+import numpy as np
+
+from npsem.bandits import (POLICIES, KLUCBAgent, SupKLTable, ThompsonSamplingAgent, VariateBlocks, _normals, _standard_gamma, _uniforms, default_kl_UCB_func,
+                           play_bandits, simulate, sup_KL, thompson_sampling, trial_seeds, trial_streams)
+
+
+def test_sup_kl_table_never_under_estimates():
+    table = SupKLTable(n_mu=64, n_divergence=128)
+    rng = np.random.default_rng(0)
+    N = rng.integers(1, 10000, 20000)
+    mu_ref = np.concatenate([rng.binomial(N, rng.random(len(N))) / N, [0, 1, 0.5, 1 - 1e-9]])
+    divergence = np.concatenate([np.exp(rng.uniform(-18, 5, len(N))), [1e-5, 1e-5, 1e-9, 3]])
+    looked_up, exact = table.sup_KL(mu_ref, divergence), sup_KL(mu_ref, divergence)
+    assert np.all(looked_up >= exact)
+    assert np.mean(looked_up - exact) < 5e-3
+
+
+def test_sup_kl_of_a_few_pairs_is_the_same_as_of_many():
+    rng = np.random.default_rng(0)
+    N = rng.integers(1, 10000, 5000)
+    mu_ref = np.concatenate([rng.binomial(N, rng.random(len(N))) / N, [0, 1, 0.5, 1 - 1e-9, 0.3, 0.3]])
+    divergence = np.concatenate([np.exp(rng.uniform(-18, 5, len(N))), [1e-5, 1e-5, 1e-9, 3, 0, np.inf]])
+    at_once = sup_KL(mu_ref, divergence)
+    assert np.array_equal(at_once, [sup_KL(p, d) for p, d in zip(mu_ref, divergence)])
+    assert np.array_equal(at_once[:10], sup_KL(mu_ref[:10], divergence[:10]))
+
+
+def test_kl_ucb_agent_selects_an_arm_of_the_largest_index():
+    rng = np.random.default_rng(0)
+    mu = rng.random(12)
+    agent = KLUCBAgent(range(12), seed=0)
+    for t in range(2000):
+        arm = agent.select()
+        if t >= 12:
+            indices = sup_KL(agent.mu_hat, default_kl_UCB_func(agent.t) / agent.N)
+            assert indices[arm] >= indices.max() - 1e-9
+        agent.update(arm, int(rng.random() < mu[arm]))
+    assert np.all(agent.N > 0)
+
+
+def test_agents_select_n_arms_by_their_indices():
+    rng = np.random.default_rng(0)
+    mu = rng.random(12)
+    kl_ucb, ts = KLUCBAgent(range(12), seed=0), ThompsonSamplingAgent(range(12), seed=0)
+    for t in range(300):
+        for agent in (kl_ucb, ts):
+            arm = agent.select()
+            agent.update(arm, int(rng.random() < mu[arm]))
+    ranked = kl_ucb.select(30)
+    indices = sup_KL(kl_ucb.mu_hat, default_kl_UCB_func(kl_ucb.t) / kl_ucb.N)
+    assert sorted(ranked[:12]) == list(range(12)) and np.array_equal(ranked[12:24], ranked[:12])
+    assert np.all(np.diff(indices[ranked[:12]]) <= 0)
+    one_by_one = ThompsonSamplingAgent.from_state(ts.state(), seed=1)
+    at_once = np.bincount(ts.select(4000), minlength=12) / 4000
+    assert np.allclose(at_once, np.bincount([one_by_one.select() for _ in range(4000)], minlength=12) / 4000, atol=0.03)
+
+
+def test_standard_gamma_moments():
+    streams = [trial_streams(seed) for seed in range(3)]
+    normals = VariateBlocks([stream[3] for stream in streams], _normals, 1000)
+    uniforms = VariateBlocks([stream[4] for stream in streams], _uniforms, 1000)
+    shape = np.tile([1.0, 2.5, 40.0], (3, 1000))
+    draws = np.zeros_like(shape)
+    samples = []
+    for _ in range(20):
+        _standard_gamma(shape, normals, uniforms, out=draws)
+        samples.append(draws.copy())
+    samples = np.concatenate(samples).reshape(-1, 3)
+    # Gamma(k) has mean and variance k
+    assert np.allclose(samples.mean(axis=0), [1.0, 2.5, 40.0], rtol=0.02)
+    assert np.allclose(samples.var(axis=0), [1.0, 2.5, 40.0], rtol=0.05)
+    assert np.all(samples > 0)
+
+
+def test_variate_blocks_take_the_streams_in_order():
+    rngs = [np.random.default_rng(seed) for seed in range(3)]
+    blocks = VariateBlocks(rngs, _uniforms, 5)
+    taken = [[] for _ in range(3)]
+    for counts in ([1, 0, 2], [4, 4, 4], [0, 7, 1], [1, 1, 1], [12, 0, 3], [2, 2, 2]):
+        values = blocks.take(np.array(counts))
+        assert len(values) == sum(counts)
+        for b, chunk in enumerate(np.split(values, np.cumsum(counts)[:-1])):
+            taken[b].extend(chunk.tolist())
+    taken[1].append(blocks.next(1))
+    taken[0].append(blocks.take_one()[0])
+    for b, values in enumerate(taken):
+        assert np.array_equal(values, np.random.default_rng(b).random(len(values)))
+
+
+def test_trials_do_not_depend_on_block_size_nor_batch():
+    mu = np.array([0.3, 0.6, 0.6, 0.9, 1.2, 1.2])  # ties of arms
+    seeds = trial_seeds(0, 4)
+    for algo in ('TS', 'UCB', 'EpsGreedy'):
+        arms, rewards = simulate(algo, 400, mu, seeds)
+        small = simulate(algo, 400, mu, seeds, block_size=7)
+        assert np.array_equal(arms, small[0]) and np.array_equal(rewards, small[1])
+        assert np.array_equal(arms[1:3], simulate(algo, 400, mu, seeds[1:3])[0])
+        if algo == 'TS':
+            assert np.array_equal(arms[2], thompson_sampling(400, mu, seed=seeds[2])[0])
+    played, _ = play_bandits(400, mu, 'TS', 4, seed=0, batch_size=3)
+    assert np.array_equal(played, play_bandits(400, mu, 'TS', 4, seed=0)[0])
+
+
+def test_every_policy_takes_a_prior():
+    mu = np.array([1.2, 1.35, 1.5])
+    prior_SF = ([0, 0, 1000], [1000, 1000, 0])  # arm 2 is known to be the best
+    for algo in POLICIES:
+        arms, _ = simulate(algo, 100, mu, trial_seeds(0, 2), prior_SF=prior_SF)
+        assert np.mean(arms[:, 10:] == 2) > 0.85
@@ -0,0 +1,144 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from npsem.NIPS2025POMISPLUS_exp.scm_examples import W0toY2, WttoYtprime, X0toY2
+from npsem.model import CausalDiagram, QueryCache, StructuralCausalModel, default_P_U
+from npsem.utils import sortup
+
+EXAMPLES = [X0toY2, W0toY2, WttoYtprime]
+CONDITIONS = [{}, {'Y0': 1}, {'X0': 0, 'Y0': 1}]
+INTERVENTIONS = [{}, {'X1': 0}, {'X0': 1, 'X1': 1}, {'X1': 1, 'Y1': 0}]
+
+
+def outcome_of(M):
+    return max(V_i for V_i in M.G.V if V_i.startswith('Y')),
+
+
+@pytest.mark.parametrize('example', EXAMPLES)
+def test_backends_agree(example):
+    M, _ = example(True, seed=0)
+    Y = outcome_of(M)
+    for condition in CONDITIONS:
+        for intervention in INTERVENTIONS:
+            args = Y + ('Y0',), sortup(condition.items()), sortup(intervention.items())
+            exact, result = M.query00(*args), M.query_numpy(*args)
+            assert exact.keys() == result.keys()
+            assert all(np.isclose(exact[y], result[y]) for y in exact)
+
+
+@pytest.mark.parametrize('example', EXAMPLES)
+def test_batched_queries_agree_with_query(example):
+    M, _ = example(True, seed=0)
+    Y = outcome_of(M)
+    for condition in CONDITIONS:
+        probs = M.query_many(Y, INTERVENTIONS, condition)
+        means = M.query_expectations(Y, INTERVENTIONS, condition)
+        for i, intervention in enumerate(INTERVENTIONS):
+            result = M.query(Y, condition, intervention)
+            # nan given a condition which the intervention makes impossible
+            assert np.allclose(probs[i], [result[(0,)], result[(1,)]], equal_nan=True)
+            assert np.isclose(means[i, 0], result[(1,)], equal_nan=True)
+
+
+@pytest.mark.parametrize('example', EXAMPLES)
+def test_evaluate_trie_and_early_reject_agree_with_evaluate(example):
+    M, _ = example(True, seed=0)
+    p_u, U_columns = M.exogenous_columns()
+    for i, assigned in M.evaluate_trie(U_columns, INTERVENTIONS):
+        expected = M.evaluate(U_columns, INTERVENTIONS[i])
+        assert all(np.array_equal(assigned[k], expected[k]) for k in expected)
+
+    for condition in CONDITIONS:
+        for intervention in INTERVENTIONS:
+            expected = M.evaluate(U_columns, intervention)
+            agree = np.logical_and.reduce([expected[C] == c for C, c in condition.items()] + [np.ones(len(p_u), dtype=bool)])
+            p_agree, assigned = M.evaluate_columns(intervention, condition=condition)
+            assert np.array_equal(p_agree, p_u[agree])
+            assert all(np.array_equal(assigned[k], expected[k][agree]) for k in expected)
+
+
+def test_spec_model_pickles_as_the_same_model():
+    M, _ = X0toY2(True, seed=0)
+    unpickled = pickle.loads(pickle.dumps(M))
+    assert type(unpickled) is type(M) and unpickled.spec == M.spec
+    assert unpickled.fingerprint() == M.fingerprint()
+    assert unpickled.query(('Y2',), {'Y0': 1}) == M.query(('Y2',), {'Y0': 1})
+    assert X0toY2(False, seed=1)[0].fingerprint() != M.fingerprint()
+
+
+@pytest.mark.parametrize('backend', ['python', 'numpy'])
+def test_condition_on_exogenous(backend):
+    M, _ = X0toY2(True, seed=0)
+    for u, expected in ((0, 0.1544), (1, 0.8456)):
+        result = M.query(('Y0',), {'U_X0': u}, backend=backend)
+        assert np.isclose(result[(1,)], expected)
+        result = M.query(('Y0',), {'U_X0': u, 'X0': 1}, backend=backend)
+        assert np.isclose(result[(1,)], expected)
+    assert not M.query(('Y0',), {'U_X0': 2}, backend=backend)
+
+
+def test_expectations_are_the_same_alone_or_batched():
+    M, _ = X0toY2(True, seed=0)
+    interventions = [{}, {'X0': 1}, {'X1': 0, 'Z1': 1}, {'X0': 0, 'X1': 1, 'Z1': 0}]
+    batched = M.query_expectations(('Y1', 'Y2'), interventions)
+    for i, intervention in enumerate(interventions):
+        assert np.array_equal(M.query_expectations(('Y1', 'Y2'), [intervention])[0], batched[i])
+
+
+@pytest.mark.parametrize('backend', ['python', 'numpy'])
+def test_expectation_given_impossible_condition_is_nan(backend):
+    M, _ = X0toY2(True, seed=0)
+    M.backend = backend
+    assert np.all(np.isnan(M.query_expectations(('Y2',), [{}, {'X1': 1}], {'U_X0': 2})))
+
+
+class Unrepresentable:
+    """ table represented by its memory address """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __getitem__(self, i):
+        return self.table[i]
+
+    def __len__(self):
+        return len(self.table)
+
+
+def model_with_table(table):
+    G = CausalDiagram({'X', 'Y'}, [('X', 'Y')])
+
+    def lookup(v):
+        return table[v['U_Y'] * len(table) // 2]
+
+    F = {'X': lambda v: v['U_X'], 'Y': lambda v: lookup(v) ^ v['X']}
+    return StructuralCausalModel(G, F, default_P_U({'U_X': 0.5, 'U_Y': 0.2}), more_U={'U_X', 'U_Y'})
+
+
+def test_fingerprint_of_functions():
+    table = np.zeros(2000, dtype=int)
+    other = table.copy()
+    other[1000] = 1
+    assert model_with_table(table).fingerprint() == model_with_table(table.copy()).fingerprint()
+    assert model_with_table(table).fingerprint() != model_with_table(other).fingerprint()
+    assert model_with_table(Unrepresentable(table)).fingerprint() is None
+
+
+def test_query_cache_keys():
+    M, _ = X0toY2(True, seed=0)
+    key = M.query_key(('Y0',), {'Z0': 1, 'X0': 0}, {'X1': 1})
+    assert key == M.query_key(('Y0',), {'X0': 0, 'Z0': 1}, {})  # X1 affects neither Y0 nor the condition
+    assert key != M.query_key(('Y0',), {'X0': 0, 'Z0': 1}, {'Z0': 1})
+
+    cache = QueryCache()
+    tables = [np.zeros(2, dtype=int), np.ones(2, dtype=int)]
+    for table, y in zip(tables, (0, 1)):
+        M = model_with_table(table)
+        M.query_cache = cache
+        assert M.query(('Y',), intervention={'X': 0})[(y,)] == 1
+    for table, y in zip(tables, (0, 1)):
+        M = model_with_table(Unrepresentable(table))
+        M.query_cache = cache
+        assert M.query(('Y',), intervention={'X': 0})[(y,)] == 1
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from npsem.NIPS2025POMISPLUS_exp.scm_examples import X0toY2
+from npsem.scm_spec import load_scm
+
+# evidence of probability about 1e-3 under X0toY2(seed=0)
+RARE_CONDITION = {'Y0': 1, 'Z0': 1, 'X0': 0, 'Y1': 0, 'X1': 0, 'Z1': 0}
+
+
+def test_conditional_query_agrees_with_exact():
+    M, _ = X0toY2(True, seed=0)
+    exact = M.query(('Y2',), RARE_CONDITION)
+    for batch_size in (256, 4096):
+        estimates, errors = M.query_monte_carlo(('Y2',), RARE_CONDITION, batch_size=batch_size)
+        for y in [(0,), (1,)]:
+            assert errors[y] > 0
+            assert abs(estimates[y] - exact[y]) <= 4 * errors[y]
+
+
+def test_conditional_expectation_agrees_with_exact():
+    M, _ = X0toY2(True, seed=0)
+    exact = M.query(('Y2',), RARE_CONDITION)[(1,)]
+    means, error = M.query_expectation_monte_carlo(('Y2',), condition=RARE_CONDITION)
+    assert error > 0
+    assert abs(means[0] - exact) <= 4 * error
+
+
+def test_exogenous_without_factor_is_sampled_uniformly():
+    M, _ = X0toY2(True, seed=0)
+    spec = dict(M.spec, P_U={U_i: mu_i for U_i, mu_i in M.spec['P_U'].items() if U_i != 'U_Z0'})
+    M = load_scm(spec, backend='numpy')
+    columns = M.sample_exogenous(20000, {'U_Z0'}, np.random.default_rng(0))
+    assert abs(np.mean(columns['U_Z0']) - 0.5) < 0.02
+    estimates, errors = M.query_monte_carlo(('Y0',), precision=5e-3)
+    exact = M.query(('Y0',))
+    assert abs(estimates[(1,)] - exact[(1,)]) <= 4 * errors[(1,)]
+
+
+def test_sampling_requires_factorized_exogenous():
+    M, _ = X0toY2(True, seed=0)
+    M.P_U = lambda u: 1 / 2 ** len(u)
+    with pytest.raises(AssertionError):
+        M.query_monte_carlo(('Y0',))
@@ -0,0 +1,29 @@
+import functools
+
+import numpy as np
+import pytest
+
+from npsem.NIPS2025POMISPLUS_exp.scm_examples import X0toY2
+from npsem.scm_bandits import SCM_to_bandit_machine, bandit_artifacts, ns_arm_types
+
+
+def test_bandit_machine_in_worker_processes():
+    M, _ = X0toY2(True, seed=0)
+    mu, _ = SCM_to_bandit_machine(M, ('Y2',), n_jobs=None)
+    assert SCM_to_bandit_machine(M, ('Y2',), n_jobs=2)[0] == mu
+    with pytest.raises(AssertionError):
+        SCM_to_bandit_machine(M, ('Y2',), n_jobs=2, model_factory=functools.partial(X0toY2, False, seed=1))
+
+
+def test_bandit_artifacts_round_trip(tmp_path):
+    M, _ = X0toY2(True, seed=0)
+    Ys = ('Y0', 'Y1', 'Y2')
+    mu, arm_setting, arms_of = bandit_artifacts(M, Ys, ns_arm_types(), directory=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    loaded_mu, loaded_setting, loaded_arms_of = bandit_artifacts(M, Ys, ns_arm_types(), directory=str(tmp_path))
+    assert np.array_equal(loaded_mu, mu, equal_nan=True)
+    assert loaded_arms_of == arms_of
+    assert all(loaded_setting[arm_x] == arm_setting[arm_x] for arm_x in range(len(arm_setting)))
+    assert len(loaded_setting) == len(arm_setting)
+    for arm_x in arms_of['POMIS']:
+        assert np.isclose(mu[arm_x], M.query_expectation(Ys, arm_setting[arm_x]))